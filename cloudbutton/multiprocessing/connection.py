@@ -249,6 +249,12 @@ class _ConnectionBase:
             raise ValueError("buffer length < offset + size")
         self._send_bytes(m[offset:offset + size])
 
+    def send_bytes_many(self, bufs):
+        """Send the bytes data of several bytes-like objects at once"""
+        self._check_closed()
+        self._check_writable()
+        self._send_bytes_many([memoryview(buf).tobytes() for buf in bufs])
+
     def send(self, obj):
         """Send a (picklable) object"""
         self._check_closed()
@@ -318,6 +324,7 @@ class Connection(_ConnectionBase):
     Connection class for Redis.
     """
     _write = None
+    _write_many = None
     _read = None
 
     def __init__(self, handle, readable=True, writable=True):
@@ -329,10 +336,12 @@ class Connection(_ConnectionBase):
         if self._handle.startswith(REDIS_LIST_CONN):
             self._read = self._listread
             self._write = self._listwrite
+            self._write_many = self._listwrite_many
 
         elif self._handle.startswith(REDIS_PUBSUB_CONN):
             self._read = self._channelread
             self._write = self._channelwrite
+            self._write_many = self._channelwrite_many
             self._pubsub = self._client.pubsub()
             self._pubsub.subscribe(self._subhandle)
             self._gen = self._pubsub.listen()
@@ -349,7 +358,8 @@ class Connection(_ConnectionBase):
         self._connect()
 
     def __len__(self):
-        return self._client.llen(self._handle)
+        # number of messages waiting to be read
+        return self._client.llen(self._subhandle)
 
     def _close(self, _close=None):
         # older versions of StrictRedis can't be closed
@@ -359,6 +369,9 @@ class Connection(_ConnectionBase):
     def _listwrite(self, handle, buf):
         return self._client.rpush(handle, buf)
 
+    def _listwrite_many(self, handle, bufs):
+        return self._client.rpush(handle, *bufs)
+
     def _listread(self, handle):
         _, v = self._client.blpop([handle])
         return v
@@ -366,6 +379,12 @@ class Connection(_ConnectionBase):
     def _channelwrite(self, handle, buf):
         return self._client.publish(handle, buf)
 
+    def _channelwrite_many(self, handle, bufs):
+        pipeline = self._client.pipeline(transaction=False)
+        for buf in bufs:
+            pipeline.publish(handle, buf)
+        return pipeline.execute()
+
     def _channelread(self, handle):
         msg = next(self._gen)
         return msg['data']
@@ -379,6 +398,10 @@ class Connection(_ConnectionBase):
     def _send_bytes(self, buf):
         self._write(self._handle, buf.tobytes())
 
+    def _send_bytes_many(self, bufs):
+        if bufs:
+            self._write_many(self._handle, bufs)
+
     def _recv_bytes(self, maxsize=None):
         buf = io.BytesIO()
         chunk = self._read(self._subhandle)
@@ -644,35 +667,163 @@ if hasattr(selectors, 'PollSelector'):
 else:
     _WaitSelector = selectors.SelectSelector
 
+# Blocking slice used when handles cannot be multiplexed on one command
+_WAIT_SLICE = 0.1
+
+
+def _server_of(client):
+    kwargs = client.connection_pool.connection_kwargs
+    return (kwargs.get('host'), kwargs.get('port'),
+            kwargs.get('db'), kwargs.get('path'))
+
+
+def _ready_lists(client, handles):
+    pipeline = client.pipeline(transaction=False)
+    for handle in handles:
+        pipeline.llen(handle)
+    lengths = pipeline.execute()
+    return [handle for handle, l in zip(handles, lengths) if l > 0]
+
+
+# KEYS[1] - list an item was popped from
+# KEYS[2...] - other lists waited on
+# ARGV[1] - popped item
+# puts the item back at the head of its list and
+# returns the lengths of the other lists
+LUA_PEEK_BACK_SCRIPT = """
+    redis.call('lpush', KEYS[1], ARGV[1])
+    local lengths = {}
+    for i = 2, #KEYS do
+        lengths[i - 1] = redis.call('llen', KEYS[i])
+    end
+    return lengths
+"""
+
+def _wait_lists(client, handles, timeout):
+    '''
+    Block until any of the list handles has an item, without consuming it.
+
+    A single BLPOP covers every handle; the popped item is pushed back
+    to the head of its list (peek-back) so no message is lost. The
+    push-back and the check of the remaining handles are one script.
+    '''
+    # only block, and pop, if nothing is ready yet
+    ready = _ready_lists(client, handles)
+    if ready or (timeout is not None and timeout <= 0):
+        return ready
+
+    res = client.blpop(handles, timeout=util._block_timeout(timeout))
+    if res is None:
+        return []
+
+    key, value = res
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    others = [handle for handle in handles if handle != key]
+
+    peek_back = client.register_script(LUA_PEEK_BACK_SCRIPT)
+    lengths = peek_back(keys=[key, *others], args=[value])
+    ready = set([key] + [h for h, l in zip(others, lengths) if l > 0])
+    return [handle for handle in handles if handle in ready]
+
+
+def _wait_pubsubs(pubsubs, timeout):
+    # messages may already be buffered by the parser
+    ready = [p for p in pubsubs if p.connection.can_read()]
+    if ready or (timeout is not None and timeout <= 0):
+        return ready
+
+    with _WaitSelector() as selector:
+        for p in pubsubs:
+            selector.register(p.connection._sock, selectors.EVENT_READ, p)
+        return [key.data for key, events in selector.select(timeout)]
+
+
+def _is_handle(obj):
+    return isinstance(obj, tuple) and len(obj) == 2 \
+        and isinstance(obj[1], str)
+
 
 def wait(object_list, timeout=None):
     '''
     Wait till an object in object_list is ready/readable.
 
+    Objects are either (client, handle) pairs or process sentinels
+    (`Process.sentinel`).
+
     Returns list of those objects in object_list which are ready/readable.
     '''
+    from .popen_cloud import wait_sentinels, POLL_INTERVAL
+
     if timeout is not None:
         deadline = time.monotonic() + timeout
 
-    while True:
+    # group list handles by redis server so that any number of them
+    # can be waited on with one blocking command
+    lists = {}
+    pubsubs = []
+    sentinels = []
+    for obj in object_list:
+        if not _is_handle(obj):
+            sentinels.append(obj)
+            continue
+        client, handle = obj
+        if handle.startswith(REDIS_LIST_CONN):
+            server = _server_of(client)
+            if server not in lists:
+                lists[server] = (client, [])
+            lists[server][1].append(handle)
+        elif handle.startswith(REDIS_PUBSUB_CONN):
+            pubsubs.append(client)
+
+    def collect(ready_lists=(), ready_pubsubs=(), ready_sentinels=()):
         ready = []
-        for client, handle in object_list:
-            if handle.startswith(REDIS_LIST_CONN):
-                l = client.llen(handle)
-                if l > 0:
-                    ready.append((client, handle))
-            elif handle.startswith(REDIS_PUBSUB_CONN)\
-                 and client.connection.can_read():
-                ready.append((client, handle))
-                
-        if any(ready):
-            return ready
-
+        for obj in object_list:
+            if not _is_handle(obj):
+                if obj in ready_sentinels:
+                    ready.append(obj)
+            elif obj[1] in ready_lists or obj[0] in ready_pubsubs:
+                ready.append(obj)
+        return ready
+
+    if not sentinels:
+        if not pubsubs and len(lists) == 1:
+            client, handles = next(iter(lists.values()))
+            return collect(ready_lists=_wait_lists(client, handles, timeout))
+
+        if not lists:
+            return collect(ready_pubsubs=_wait_pubsubs(pubsubs, timeout))
+
+    elif not lists and not pubsubs:
+        # one status query per round for all of the processes
+        return collect(ready_sentinels=wait_sentinels(sentinels, timeout))
+
+    # Mixed servers/object types cannot be multiplexed on a single
+    # command, so block on each group for a short slice in turn.
+    # Process status is queried at most once every POLL_INTERVAL
+    waittime = 0.0
+    last_query = None
+    while True:
+        ready_lists = []
+        for client, handles in lists.values():
+            ready_lists.extend(_wait_lists(client, handles, waittime))
+        ready_pubsubs = _wait_pubsubs(pubsubs, 0.0) if pubsubs else []
+        ready_sentinels = []
+        now = time.monotonic()
+        if sentinels and (last_query is None or
+                          now - last_query >= POLL_INTERVAL):
+            last_query = now
+            ready_sentinels = wait_sentinels(sentinels, 0.0)
+
+        if ready_lists or ready_pubsubs or ready_sentinels:
+            return collect(ready_lists, ready_pubsubs, ready_sentinels)
+
+        waittime = _WAIT_SLICE
         if timeout is not None:
-            timeout = deadline - time.monotonic()
-            if timeout < 0:
-                return ready
-        time.sleep(0.1)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            waittime = min(waittime, remaining)
 
 #
 # Make connection and socket objects sharable if possible
@@ -79,16 +79,21 @@ class BaseContext(object):
         from .connection import Pipe
         return Pipe(duplex)
 
-    def Lock(self):
+    def Lock(self, lease=None):
         '''Returns a non-recursive lock object'''
         from .synchronize import Lock
-        return Lock()
+        return Lock(lease)
 
     def RLock(self):
         '''Returns a recursive lock object'''
         from .synchronize import RLock
         return RLock()
 
+    def RWLock(self):
+        '''Returns a many-readers/one-writer lock object'''
+        from .synchronize import RWLock
+        return RWLock()
+
     def Condition(self, lock=None):
         '''Returns a condition object'''
         from .synchronize import Condition
@@ -117,12 +122,12 @@ class BaseContext(object):
     def Queue(self, maxsize=0):
         '''Returns a queue object'''
         from .queues import Queue
-        return Queue()
+        return Queue(maxsize)
 
     def JoinableQueue(self, maxsize=0):
         '''Returns a queue object'''
         from .queues import JoinableQueue
-        return JoinableQueue()
+        return JoinableQueue(maxsize)
 
     def SimpleQueue(self):
         '''Returns a queue object'''
@@ -130,37 +135,39 @@ class BaseContext(object):
         return SimpleQueue()
 
     def Pool(self, processes=None, initializer=None, initargs={},
-             maxtasksperchild=None):
+             maxtasksperchild=None, **kwargs):
         '''Returns a process pool object'''
         from .pool import Pool
         return Pool(processes, initializer, initargs, maxtasksperchild,
-                    context=self.get_context())
-    """
+                    context=self.get_context(), **kwargs)
+
     def RawValue(self, typecode_or_type, *args):
         '''Returns a shared object'''
         from .sharedctypes import RawValue
         return RawValue(typecode_or_type, *args)
-    """
-    """
+
     def RawArray(self, typecode_or_type, size_or_initializer):
         '''Returns a shared array'''
         from .sharedctypes import RawArray
         return RawArray(typecode_or_type, size_or_initializer)
-    """
-    """
+
     def Value(self, typecode_or_type, *args, lock=True):
         '''Returns a synchronized shared object'''
         from .sharedctypes import Value
         return Value(typecode_or_type, *args, lock=lock,
                      ctx=self.get_context())
-    """
-    """
+
     def Array(self, typecode_or_type, size_or_initializer, *, lock=True):
         '''Returns a synchronized shared array'''
         from .sharedctypes import Array
         return Array(typecode_or_type, size_or_initializer, lock=lock,
                      ctx=self.get_context())
-    """
+
+    def SharedNDArray(self, array_or_shape, dtype=None, **kwargs):
+        '''Returns a shared numpy array'''
+        from .sharedctypes import SharedNDArray
+        return SharedNDArray(array_or_shape, dtype, **kwargs)
+
     """
     def freeze_support(self):
         '''Check whether this is a fake forked process in a frozen executable.
@@ -20,10 +20,34 @@ from . import synchronize
 from . import queues
 from . import util
 from .reduction import DefaultPickler
+import array
+import collections
+import functools
 import redis
+import threading
+import time
+import weakref
+from concurrent.futures import Future
 from copy import deepcopy
 
 
+#
+# Constants
+#
+
+# Default limits of the near cache of a proxy
+NEAR_CACHE_MAXSIZE = 1024
+NEAR_CACHE_MAXBYTES = 64 * 1024 * 1024
+
+# Seconds between keepalives of the client tracking connection,
+# and between reconnection attempts once it is lost
+NEAR_CACHE_PING_INTERVAL = 30.0
+NEAR_CACHE_RETRY_INTERVAL = 5.0
+
+# Default number of items fetched per request when iterating proxies
+ITER_PAGE_SIZE = 1000
+
+
 #
 # Helper functions
 #
@@ -80,6 +104,114 @@ class Token(object):
         return cls(typeid, address, id)
 
 
+#
+# Pipelined batches of proxy operations
+#
+
+_batch_local = threading.local()
+
+def _current_batch():
+    return getattr(_batch_local, 'batch', None)
+
+
+def _unbatched(method):
+    '''
+    Marks proxy methods that need an immediate answer from the server,
+    running them inside a batch would let them overtake the operations
+    queued before
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _current_batch() is not None:
+            raise RuntimeError('{}() is not supported inside a Batch'
+                               .format(method.__name__))
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Batch:
+    '''
+    Records the operations made on proxies by this thread inside its
+    context and sends them to the server in a single pipeline on exit.
+
+    Reads return futures that are resolved when the batch is flushed.
+    Operations that need an answer right away (len, membership,
+    iteration, pop, ...) raise RuntimeError inside a batch.  Batches
+    entered while another one is active join it.  All the proxies used
+    must live in the same Redis server.
+    '''
+
+    def __init__(self, client, transaction=False):
+        self._client = client
+        self._transaction = transaction
+        self._pipeline = None
+        self._queued = []
+        self._joined = None
+
+    def queue(self, command, args, decode=None, read=False, error=None):
+        # `error` maps the server errors of the command
+        getattr(self._pipeline, command)(*args)
+        future = Future()
+        self._queued.append((future, decode, read, error))
+        return future
+
+    @staticmethod
+    def resolved(value):
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def __enter__(self):
+        active = _current_batch()
+        if active is not None:
+            self._joined = active
+            return active
+        self._pipeline = self._client.pipeline(transaction=self._transaction)
+        _batch_local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._joined is not None:
+            self._joined = None
+            return
+        _batch_local.batch = None
+        if exc_type is not None:
+            self._pipeline.reset()
+            for future, _, _, _ in self._queued:
+                future.cancel()
+            self._queued = []
+            return
+        self._flush()
+
+    def _flush(self):
+        queued, self._queued = self._queued, []
+        if not queued:
+            self._pipeline.reset()
+            return
+        results = self._pipeline.execute(raise_on_error=False)
+
+        # errors of reads are delivered through their
+        # futures, the first failed write is raised
+        error = None
+        for (future, decode, read, mapper), res in zip(queued, results):
+            if isinstance(res, Exception):
+                if mapper is not None:
+                    res = mapper(res)
+            else:
+                try:
+                    res = decode(res) if decode is not None else res
+                except Exception as e:
+                    res = e
+            if isinstance(res, Exception):
+                future.set_exception(res)
+                if not read and error is None:
+                    error = res
+            else:
+                future.set_result(res)
+        if error is not None:
+            raise error
+
+
 #
 # Definition of BaseManager
 #
@@ -105,6 +237,13 @@ class BaseManager:
     def start(self, initializer=None, initargs=()):
         self._managing = True
 
+    def pipeline(self, transaction=False):
+        '''
+        Return a context that batches the operations made on
+        proxies into a single pipeline
+        '''
+        return Batch(self._client, transaction)
+
     def _create(self, typeid, *args, **kwds):
         '''
         Create a new shared object; return the token and exposed tuple
@@ -151,6 +290,205 @@ class BaseManager:
         setattr(cls, typeid, temp)
 
 
+#
+# Client-side caching of proxy values
+#
+
+class NearCache:
+    '''
+    Local LRU cache of the unpickled values of a proxy, bounded
+    by number of entries and by their serialized size
+    '''
+
+    def __init__(self, maxsize=NEAR_CACHE_MAXSIZE, maxbytes=NEAR_CACHE_MAXBYTES):
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        # bumped on every invalidation, values fetched
+        # across an invalidation are not stored
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.active = True
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        '''
+        Return (True, value) on a hit, (False, epoch) on a miss
+        '''
+        with self._lock:
+            if self.active and key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, self._epoch
+
+    def store(self, key, value, nbytes, epoch):
+        with self._lock:
+            if not self.active or epoch != self._epoch \
+                    or nbytes > self._maxbytes:
+                return
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while len(self._entries) > self._maxsize \
+                    or self._nbytes > self._maxbytes:
+                self._nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def discard(self, key):
+        with self._lock:
+            self._epoch += 1
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._nbytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._nbytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class _InvalidationListener:
+    '''
+    Receives the client tracking invalidations (Redis >= 6) of the
+    cacheable proxies of one server and clears their near caches.
+    Only the keys of the proxies with a near cache are tracked, each
+    one registered as a broadcast prefix when its cache is enabled
+    '''
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._caches = collections.defaultdict(weakref.WeakSet)
+        self._lock = threading.Lock()
+        self._listen_conn = None
+        self._track_conn = None
+        self._client_id = None
+        self._active = True
+        self.available = self._connect()
+        if self.available:
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+
+    def _connect(self):
+        # dedicated connections, kept out of the shared pool
+        listen_conn = self._pool.connection_class(**self._pool.connection_kwargs)
+        track_conn = self._pool.connection_class(**self._pool.connection_kwargs)
+        try:
+            listen_conn.send_command('CLIENT', 'ID')
+            client_id = listen_conn.read_response()
+            listen_conn.send_command('SUBSCRIBE', '__redis__:invalidate')
+            listen_conn.read_response()
+            # fails on servers without client tracking
+            track_conn.send_command('CLIENT', 'TRACKING', 'OFF')
+            track_conn.read_response()
+            with self._lock:
+                self._track(track_conn, client_id, list(self._caches))
+                self._listen_conn = listen_conn
+                self._track_conn = track_conn
+                self._client_id = client_id
+        except redis.exceptions.RedisError as e:
+            util.debug('client tracking unavailable: %s', e)
+            listen_conn.disconnect()
+            track_conn.disconnect()
+            return False
+        return True
+
+    @staticmethod
+    def _track(track_conn, client_id, keys):
+        # BCAST without prefixes would send the invalidations of every
+        # key, prefixes can be added while tracking is on
+        if not keys:
+            return
+        prefixes = []
+        for key in keys:
+            prefixes.extend(('PREFIX', key))
+        track_conn.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT',
+                                client_id, 'BCAST', *prefixes)
+        track_conn.read_response()
+
+    def _run(self):
+        last_ping = time.monotonic()
+        while True:
+            try:
+                if self._listen_conn.can_read(timeout=NEAR_CACHE_PING_INTERVAL):
+                    self._handle(self._listen_conn.read_response())
+                if time.monotonic() - last_ping >= NEAR_CACHE_PING_INTERVAL:
+                    with self._lock:
+                        self._track_conn.send_command('PING')
+                        self._track_conn.read_response()
+                    last_ping = time.monotonic()
+            except redis.exceptions.RedisError as e:
+                # invalidations may have been missed, stop serving
+                # cached values until tracking is set up again
+                util.debug('client tracking lost: %s', e)
+                self._set_active(False)
+                self._listen_conn.disconnect()
+                self._track_conn.disconnect()
+                while not self._connect():
+                    time.sleep(NEAR_CACHE_RETRY_INTERVAL)
+                self._set_active(True)
+                last_ping = time.monotonic()
+
+    def _handle(self, message):
+        if message[0] != b'message':
+            return
+        keys = message[2]
+        with self._lock:
+            if keys is None:
+                # the whole database was flushed
+                caches = [c for cs in self._caches.values() for c in cs]
+            else:
+                caches = [c for key in keys
+                          for c in self._caches.get(key.decode(), ())]
+        for cache in caches:
+            cache.clear()
+
+    def _set_active(self, active):
+        with self._lock:
+            self._active = active
+            caches = [c for cs in self._caches.values() for c in cs]
+        for cache in caches:
+            cache.clear()
+            cache.active = active
+
+    def register(self, key, cache):
+        '''
+        Start clearing `cache` on changes to `key`. Returns whether the
+        key is tracked, a cache must not be used otherwise
+        '''
+        with self._lock:
+            if key not in self._caches:
+                try:
+                    self._track(self._track_conn, self._client_id, [key])
+                except redis.exceptions.RedisError as e:
+                    # left untracked, enabling the cache again retries
+                    util.debug('client tracking lost: %s', e)
+                    return False
+            cache.active = self._active
+            self._caches[key].add(cache)
+        return True
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+def _get_invalidation_listener(client):
+    pool = client.connection_pool
+    with _listeners_lock:
+        if pool not in _listeners:
+            _listeners[pool] = _InvalidationListener(pool)
+        return _listeners[pool]
+
+
 #
 # Definition of BaseProxy
 #
@@ -167,7 +505,39 @@ class BaseProxy(object):
 
         self._pickler = DefaultPickler() if serializer is None else serializer
         self._client = util.get_redis_client()
-        self._ref = util.RemoteReference(self._oid, client=self._client)
+        self._ref = util.RemoteReference(self._keys(), client=self._client)
+        self._cache = None
+
+    def _keys(self):
+        return [self._oid]
+
+    def __getstate__(self):
+        # the near cache is local to each process
+        state = self.__dict__.copy()
+        state['_cache'] = None
+        return state
+
+    def _enable_cache(self, maxsize=NEAR_CACHE_MAXSIZE,
+                      maxbytes=NEAR_CACHE_MAXBYTES):
+        listener = _get_invalidation_listener(self._client)
+        if not listener.available:
+            return False
+        if self._cache is None:
+            cache = NearCache(maxsize, maxbytes)
+            if not listener.register(self._oid, cache):
+                return False
+            self._cache = cache
+        return True
+
+    def _disable_cache(self):
+        self._cache = None
+
+    def _invalidate(self, k=None):
+        if self._cache is not None:
+            if k is None:
+                self._cache.clear()
+            else:
+                self._cache.discard(k)
 
     def _getvalue(self):
         '''
@@ -210,6 +580,13 @@ class BaseProxy(object):
 #        
 #        Current implementation is the same as multiprocessing
 
+def _lset_error(error):
+    # LSET fails when the index is out of range
+    if isinstance(error, redis.exceptions.ResponseError):
+        return IndexError('list assignment index out of range')
+    return error
+
+
 class ListProxy(BaseProxy):
 
     # KEYS[1] - key to extend
@@ -239,13 +616,20 @@ class ListProxy(BaseProxy):
         if isinstance(i, int) or hasattr(i, '__index__'):
             idx = i.__index__()
             serialized = self._pickler.dumps(obj)
+            batch = _current_batch()
+            if batch is not None:
+                batch.queue('lset', (self._oid, idx, serialized),
+                            error=_lset_error)
+                return
             try:
                 self._client.lset(self._oid, idx, serialized)
-            except redis.exceptions.ResponseError:
-                # raised when index >= len(self)
-                raise IndexError('list assignment index out of range')
+            except redis.exceptions.ResponseError as e:
+                raise _lset_error(e)
 
         elif isinstance(i, slice):    # TODO: step
+            if _current_batch() is not None:
+                raise RuntimeError('slice assignment is not supported '
+                                   'inside a Batch')
             start, end, step = deslice(i)
             if start is None:
                 return
@@ -277,31 +661,51 @@ class ListProxy(BaseProxy):
     def __getitem__(self, i):
         if isinstance(i, int) or hasattr(i, '__index__'):
             idx = i.__index__()
-            serialized = self._client.lindex(self._oid, idx)
-            if serialized is not None:
-                return self._pickler.loads(serialized)
-            raise IndexError('list index out of range')
+            batch = _current_batch()
+            if batch is not None:
+                return batch.queue('lindex', (self._oid, idx),
+                                   self._load_item, read=True)
+            return self._load_item(self._client.lindex(self._oid, idx))
 
         elif isinstance(i, slice):    # TODO: step
+            if _current_batch() is not None:
+                raise RuntimeError('slicing is not supported inside a Batch')
             start, end, step = deslice(i)
             if start is None:
                 return []
-            serialized = self._client.lrange(self._oid, start, end)
-            unserialized = [self._pickler.loads(obj) for obj in serialized]
-            return unserialized
+            return list(self._iter_range(start, end))
             #return type(self)(unserialized)
         else:
             raise TypeError('list indices must be integers '
                 'or slices, not {}'.format(type(i)))
 
+    def _load_item(self, serialized):
+        if serialized is None:
+            raise IndexError('list index out of range')
+        return self._pickler.loads(serialized)
+
+    def batch(self, transaction=False):
+        '''
+        Return a context that batches the operations made on
+        proxies into a single pipeline
+        '''
+        return Batch(self._client, transaction)
+
     def extend(self, iterable):
         if isinstance(iterable, type(self)):
             self._extend_same_type(iterable, 1)
         else:
             if iterable != []:
-                values = map(self._pickler.dumps, iterable)
-                self._client.rpush(self._oid, *values)
-
+                values = list(map(self._pickler.dumps, iterable))
+                if not values:
+                    return
+                batch = _current_batch()
+                if batch is not None:
+                    batch.queue('rpush', (self._oid, *values))
+                else:
+                    self._client.rpush(self._oid, *values)
+
+    @_unbatched
     def _extend_same_type(self, listproxy, repeat=1):
         self._lua_extend_list(keys=[self._oid, listproxy._oid],
                               args=[repeat],
@@ -309,8 +713,13 @@ class ListProxy(BaseProxy):
 
     def append(self, obj):
         serialized = self._pickler.dumps(obj)
-        self._client.rpush(self._oid, serialized)
+        batch = _current_batch()
+        if batch is not None:
+            batch.queue('rpush', (self._oid, serialized))
+        else:
+            self._client.rpush(self._oid, serialized)
 
+    @_unbatched
     def pop(self, index=None):
         if index is None:
             serialized = self._client.rpop(self._oid)
@@ -323,6 +732,7 @@ class ListProxy(BaseProxy):
             self.remove(sentinel)
             return item
 
+    @_unbatched
     def __deepcopy__(self, memo):
         selfcopy = type(self)()
 
@@ -370,46 +780,85 @@ class ListProxy(BaseProxy):
             self._extend_same_type(self, repeat=n-1)
         return self
 
+    @_unbatched
     def __len__(self):
         return self._client.llen(self._oid)
 
     def remove(self, obj):
         serialized = self._pickler.dumps(obj)
-        self._client.lrem(self._oid, 1, serialized)
+        batch = _current_batch()
+        if batch is not None:
+            batch.queue('lrem', (self._oid, 1, serialized))
+        else:
+            self._client.lrem(self._oid, 1, serialized)
         return self
 
+    @_unbatched
     def __delitem__(self, i):
         sentinel = util.get_uuid()
         self[i] = sentinel
         self.remove(sentinel)
 
+    def __iter__(self):
+        return self.iterate()
+
+    @_unbatched
+    def iterate(self, page_size=None):
+        '''
+        Lazily iterate over the list, fetching page_size items per request
+        '''
+        return self._iter_range(0, -1, page_size)
+
+    def _iter_range(self, start, end, page_size=None):
+        # items from start to end (inclusive) fetched with windowed
+        # LRANGEs; an end of -1 reads until the list is exhausted
+        page_size = page_size or ITER_PAGE_SIZE
+        if start < 0 or end < -1:
+            length = len(self)
+            start = max(start + length, 0) if start < 0 else start
+            end = end + length if end < 0 else end
+        while end == -1 or start <= end:
+            stop = start + page_size - 1
+            if end != -1:
+                stop = min(stop, end)
+            page = self._client.lrange(self._oid, start, stop)
+            for serialized in page:
+                yield self._pickler.loads(serialized)
+            if len(page) < stop - start + 1:
+                return
+            start = stop + 1
+
+    @_unbatched
     def tolist(self):
-        serialized = self._client.lrange(self._oid, 0, -1)
-        unserialized = [self._pickler.loads(obj) for obj in serialized]
-        return unserialized
+        return list(self.iterate())
 
     # The following methods can't be (properly) implemented on Redis
     # To still provide the functionality, the list is fetched
     # entirely, operated in-memory and then put back to Redis
 
+    @_unbatched
     def reverse(self):
         rev = reversed(self[:])
         self._client.delete(self._oid)
         self.extend(rev)
         return self
 
+    @_unbatched
     def sort(self, key=None, reverse=False):
         sortd = sorted(self[:], key=key, reverse=reverse)
         self._client.delete(self._oid)
         self.extend(sortd)
         return self
 
+    @_unbatched
     def index(self, obj, start=0, end=-1):
         return self[:].index(obj, start, end)
 
+    @_unbatched
     def count(self, obj):
         return self[:].count(obj)
 
+    @_unbatched
     def insert(self, index, obj):
         new_list = self[:]
         new_list.insert(index, obj)
@@ -423,33 +872,90 @@ class DictProxy(BaseProxy):
         super().__init__('dict')
         self.update(*args, **kwargs)
 
+    def enable_cache(self, maxsize=NEAR_CACHE_MAXSIZE,
+                     maxbytes=NEAR_CACHE_MAXBYTES):
+        '''
+        Keep the values read by this process in a local LRU cache,
+        invalidated through Redis client tracking (Redis >= 6).
+        Cached values are shared between reads and must not be
+        modified in place. Return whether the cache is enabled.
+        '''
+        return self._enable_cache(maxsize, maxbytes)
+
+    def disable_cache(self):
+        self._disable_cache()
+
+    def batch(self, transaction=False):
+        '''
+        Return a context that batches the operations made on
+        proxies into a single pipeline
+        '''
+        return Batch(self._client, transaction)
+
     def __setitem__(self, k, v):
         serialized = self._pickler.dumps(v)
-        self._client.hset(self._oid, k, serialized)
+        batch = _current_batch()
+        if batch is not None:
+            batch.queue('hset', (self._oid, k, serialized))
+        else:
+            self._client.hset(self._oid, k, serialized)
+        self._invalidate(k)
 
     def __getitem__(self, k):
-        serialized = self._client.hget(self._oid, k)
-        if serialized is None:
-            raise KeyError(k)
+        cache = self._cache
+        if cache is not None:
+            hit, value = cache.lookup(k)
+            if hit:
+                return Batch.resolved(value) \
+                    if _current_batch() is not None else value
+            epoch = value
+
+        def load(serialized):
+            if serialized is None:
+                raise KeyError(k)
+            unserialized = self._pickler.loads(serialized)
+            if cache is not None:
+                cache.store(k, unserialized, len(serialized), epoch)
+            return unserialized
+
+        batch = _current_batch()
+        if batch is not None:
+            return batch.queue('hget', (self._oid, k), load, read=True)
+        return load(self._client.hget(self._oid, k))
 
-        unserialized = self._pickler.loads(serialized)
-        return unserialized
-        
     def __delitem__(self, k):
-        res = self._client.hdel(self._oid, k)   
-        if res == 0:
-            raise KeyError(k)
+        def check(res):
+            if res == 0:
+                raise KeyError(k)
+
+        batch = _current_batch()
+        if batch is not None:
+            batch.queue('hdel', (self._oid, k), check)
+            self._invalidate(k)
+            return
+        res = self._client.hdel(self._oid, k)
+        self._invalidate(k)
+        check(res)
 
+    @_unbatched
     def __contains__(self, k):
         return self._client.hexists(self._oid, k)
 
+    @_unbatched
     def __len__(self):
         return self._client.hlen(self._oid)
 
     def __iter__(self):
-        return iter(self.keys())
+        return self.iterkeys()
 
     def get(self, k, default=None):
+        batch = _current_batch()
+        if batch is not None:
+            def load(serialized):
+                if serialized is None:
+                    return default
+                return self._pickler.loads(serialized)
+            return batch.queue('hget', (self._oid, k), load, read=True)
         try:
             v = self.__getitem__(k)
         except KeyError:
@@ -457,6 +963,7 @@ class DictProxy(BaseProxy):
         else:
             return v
 
+    @_unbatched
     def pop(self, k, default=None):
         try:
             v = self.__getitem__(k)
@@ -466,19 +973,20 @@ class DictProxy(BaseProxy):
             self.__delitem__(k)
             return v
 
+    @_unbatched
     def popitem(self):
-        try:
-            key = self.keys()[0]
+        for key in self.iterkeys():
             item = (key, self.__getitem__(key))
             self.__delitem__(key)
             return item
-        except IndexError:
-            raise KeyError('popitem(): dictionary is empty')
+        raise KeyError('popitem(): dictionary is empty')
 
+    @_unbatched
     def setdefault(self, k, default=None):
         serialized = self._pickler.dumps(default)
         res = self._client.hsetnx(self._oid, k, serialized)
         if res == 1:
+            self._invalidate(k)
             return default
         else:
             return self.__getitem__(k)
@@ -504,40 +1012,95 @@ class DictProxy(BaseProxy):
             items.extend((k, self._pickler.dumps(kwargs[k])))
         
         if len(items) > 0:
-            self._client.execute_command('HMSET', self._oid, *items)
+            batch = _current_batch()
+            if batch is not None:
+                batch.queue('execute_command', ('HMSET', self._oid, *items))
+            else:
+                self._client.execute_command('HMSET', self._oid, *items)
+            self._invalidate()
+
+    def _scan(self, page_size=None):
+        # raw (field, value) pairs fetched with HSCAN, which may return
+        # a field more than once if the hash is rehashed meanwhile, so
+        # the fields already yielded are remembered
+        page_size = page_size or ITER_PAGE_SIZE
+        seen = set()
+        cursor = 0
+        while True:
+            cursor, page = self._client.hscan(self._oid, cursor,
+                                              count=page_size)
+            for field, value in page.items():
+                if field not in seen:
+                    seen.add(field)
+                    yield field, value
+            if cursor == 0:
+                return
+
+    @_unbatched
+    def iterkeys(self, page_size=None):
+        '''
+        Lazily iterate over the keys, fetching about page_size per request
+        '''
+        for k, _ in DictProxy._scan(self, page_size):
+            yield k.decode()
 
+    @_unbatched
+    def itervalues(self, page_size=None):
+        '''
+        Lazily iterate over the values, fetching about page_size per request
+        '''
+        for _, v in DictProxy._scan(self, page_size):
+            yield self._pickler.loads(v)
+
+    @_unbatched
+    def iteritems(self, page_size=None):
+        '''
+        Lazily iterate over the items, fetching about page_size per request
+        '''
+        for k, v in DictProxy._scan(self, page_size):
+            yield k.decode(), self._pickler.loads(v)
+
+    @_unbatched
     def keys(self):
-        return [k.decode() for k in self._client.hkeys(self._oid)]
+        return list(DictProxy.iterkeys(self))
 
+    @_unbatched
     def values(self):
-        return [self._pickler.loads(v) for v in self._client.hvals(self._oid)]
+        return list(DictProxy.todict(self).values())
 
+    @_unbatched
     def items(self):
-        raw_dict = self._client.hgetall(self._oid)
-        items = []
-        for k, v in raw_dict.items():
-            items.append((k.decode(), self._pickler.loads(v)))
-        return items
+        return list(DictProxy.todict(self).items())
 
     def clear(self):
-        self._client.delete(self._oid)
+        batch = _current_batch()
+        if batch is not None:
+            batch.queue('delete', (self._oid,))
+        else:
+            self._client.delete(self._oid)
+        self._invalidate()
 
+    @_unbatched
     def copy(self):
         # TODO: use lua script
         return type(self)(self.items())
 
+    @_unbatched
     def todict(self):
-        raw_dict = self._client.hgetall(self._oid)
-        py_dict = {}
-        for k, v in raw_dict.items():
-            py_dict[k.decode()] = self._pickler.loads(v)
-        return py_dict
+        return dict(DictProxy.iteritems(self))
 
 
 class NamespaceProxy(BaseProxy):
-    def __init__(self, **kwargs):
+    def __init__(self, *, cache=False, **kwargs):
+        '''
+        With `cache`, the attributes read by this process are kept in a
+        local near cache, as with `DictProxy.enable_cache()`.  An
+        attribute named `cache` has to be set after creation.
+        '''
         super().__init__('Namespace')
         DictProxy.update(self, **kwargs)
+        if cache:
+            self._enable_cache()
 
     def __getattr__(self, k):
         if k[0] == '_':
@@ -564,27 +1127,349 @@ class NamespaceProxy(BaseProxy):
         return DictProxy.todict(self)
 
 
+# array/ctypes typecodes of the values stored natively as numbers
+INTEGER_TYPECODES = 'bBhHiIlLqQ'
+FLOAT_TYPECODES = 'fd'
+
+
 class ValueProxy(BaseProxy):
+
+    # integers are compared as strings, Lua numbers are doubles and
+    # would lose precision above 2**53
+    LUA_COMPARE_FUNCTION = """
+        local function compare(a, b, kind)
+            if kind ~= 'int' then
+                a, b = tonumber(a), tonumber(b)
+                if a == b then return 0 end
+                return a < b and -1 or 1
+            end
+            local neg_a = a:sub(1, 1) == '-'
+            local neg_b = b:sub(1, 1) == '-'
+            if neg_a ~= neg_b then
+                return neg_a and -1 or 1
+            end
+            local c = 0
+            if #a ~= #b then
+                c = #a < #b and -1 or 1
+            elseif a ~= b then
+                c = a < b and -1 or 1
+            end
+            return neg_a and -c or c
+        end
+    """
+
+    # KEYS[1] - value key
+    # ARGV[1] - expected value
+    # ARGV[2] - new value
+    # ARGV[3] - 'int' or 'float'
+    # return 1 if the value was swapped
+    LUA_COMPARE_AND_SWAP_SCRIPT = LUA_COMPARE_FUNCTION + """
+        local current = redis.call('GET', KEYS[1]) or '0'
+        if compare(current, ARGV[1], ARGV[3]) ~= 0 then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[2])
+        return 1
+    """
+
+    # KEYS[1] - value key
+    # ARGV[1] - candidate value
+    # ARGV[2] - 'max' or 'min'
+    # ARGV[3] - 'int' or 'float'
+    # return the resulting value
+    LUA_MAX_MIN_SCRIPT = LUA_COMPARE_FUNCTION + """
+        local current = redis.call('GET', KEYS[1])
+        if current then
+            local c = compare(ARGV[1], current, ARGV[3])
+            if (ARGV[2] == 'max' and c <= 0) or
+               (ARGV[2] == 'min' and c >= 0) then
+                return current
+            end
+        end
+        redis.call('SET', KEYS[1], ARGV[1])
+        return ARGV[1]
+    """
+
     def __init__(self, typecode='Any', value=None, lock=True):
+        # set before the remote reference asks for our keys
+        self._lock = lock or None
+        # accept ctypes types as well as typecodes
+        typecode = getattr(typecode, '_type_', typecode)
         super().__init__('Value({})'.format(typecode))
+        self._typecode = typecode
+
+        if typecode in INTEGER_TYPECODES:
+            self._number = int
+        elif typecode in FLOAT_TYPECODES:
+            self._number = float
+        else:
+            self._number = None
+
+        if self._number is not None:
+            self._lua_cas = self._client.register_script(
+                ValueProxy.LUA_COMPARE_AND_SWAP_SCRIPT)
+            util.make_stateless_script(self._lua_cas)
+            self._lua_max_min = self._client.register_script(
+                ValueProxy.LUA_MAX_MIN_SCRIPT)
+            util.make_stateless_script(self._lua_max_min)
+            if value is None:
+                value = 0
+
         if value is not None:
             self.set(value)
 
+    def _keys(self):
+        keys = super()._keys()
+        if self._lock is True:
+            # the lock is only made when asked for, but it is named
+            # after the value so that every copy gets the same one
+            keys += synchronize.RLock._keys_of(self._oid + '-lock')
+        return keys
+
+    def _make_lock(self):
+        return synchronize.RLock(name=self._oid + '-lock', client=self._client)
+
+    def _dumps(self, value):
+        if self._number is None:
+            return self._pickler.dumps(value)
+        return repr(self._number(value))
+
+    def _loads(self, serialized):
+        if self._number is None:
+            return self._pickler.loads(serialized)
+        return self._number(serialized or 0)
+
+    def _kind(self):
+        return 'int' if self._number is int else 'float'
+
+    def _check_number(self):
+        if self._number is None:
+            raise TypeError('atomic operations need a numeric typecode, '
+                            'not {!r}'.format(self._typecode))
+
+    def batch(self, transaction=False):
+        '''
+        Return a context that batches the operations made on
+        proxies into a single pipeline
+        '''
+        return Batch(self._client, transaction)
+
     def get(self):
+        batch = _current_batch()
+        if batch is not None:
+            return batch.queue('get', (self._oid,), self._loads, read=True)
         serialized = self._client.get(self._oid)
-        return self._pickler.loads(serialized)
+        return self._loads(serialized)
 
     def set(self, value):
-        serialized = self._pickler.dumps(value)
-        self._client.set(self._oid, serialized)
+        serialized = self._dumps(value)
+        batch = _current_batch()
+        if batch is not None:
+            batch.queue('set', (self._oid, serialized))
+        else:
+            self._client.set(self._oid, serialized)
 
     value = property(get, set)
 
+    def get_lock(self):
+        if self._lock is None:
+            raise AttributeError("'%s' object has no attribute 'get_lock'"
+                                 % type(self).__name__)
+        if self._lock is True:
+            self._lock = self._make_lock()
+        return self._lock
+
+    def add(self, amount):
+        '''
+        Atomically add amount to the value, return the new value
+        '''
+        self._check_number()
+        if self._number is int:
+            if not isinstance(amount, int):
+                raise TypeError('integer value can only be added integers')
+            command = 'incrby'
+        else:
+            command = 'incrbyfloat'
+        batch = _current_batch()
+        if batch is not None:
+            return batch.queue(command, (self._oid, amount), self._number)
+        return self._number(getattr(self._client, command)(self._oid, amount))
+
+    def incr(self, amount=1):
+        return self.add(amount)
+
+    def get_and_set(self, value):
+        '''
+        Atomically replace the value, return the previous one
+        '''
+        self._check_number()
+        batch = _current_batch()
+        if batch is not None:
+            return batch.queue('getset', (self._oid, self._dumps(value)),
+                               self._loads)
+        return self._loads(self._client.getset(self._oid,
+                                               self._dumps(value)))
+
+    @_unbatched
+    def compare_and_swap(self, expected, value):
+        '''
+        Set the value if it is equal to expected, return
+        whether it was set
+        '''
+        self._check_number()
+        return bool(self._lua_cas(keys=[self._oid],
+                                  args=[self._dumps(expected),
+                                        self._dumps(value), self._kind()],
+                                  client=self._client))
+
+    @_unbatched
+    def max(self, value):
+        '''
+        Atomically set the value to max(value, current), return the result
+        '''
+        self._check_number()
+        return self._loads(self._lua_max_min(keys=[self._oid],
+                                             args=[self._dumps(value), 'max',
+                                                   self._kind()],
+                                             client=self._client))
+
+    @_unbatched
+    def min(self, value):
+        '''
+        Atomically set the value to min(value, current), return the result
+        '''
+        self._check_number()
+        return self._loads(self._lua_max_min(keys=[self._oid],
+                                             args=[self._dumps(value), 'min',
+                                                   self._kind()],
+                                             client=self._client))
+
+
+class ArrayProxy(BaseProxy):
+    '''
+    Fixed-size array of machine values packed in a single Redis
+    string, elements and slices are read and written by offset
+    '''
+
+    def __init__(self, typecode, size_or_initializer, lock=True):
+        # set before the remote reference asks for our keys
+        self._lock = lock or None
+        # accept ctypes types as well as typecodes
+        typecode = getattr(typecode, '_type_', typecode)
+        super().__init__('Array({})'.format(typecode))
+        self._typecode = typecode
+        self._itemsize = array.array(typecode).itemsize
+
+        if isinstance(size_or_initializer, int):
+            initial = bytes(size_or_initializer * self._itemsize)
+            self._length = size_or_initializer
+        else:
+            values = array.array(typecode, size_or_initializer)
+            initial = values.tobytes()
+            self._length = len(values)
+        self._client.set(self._oid, initial)
+
+    def _keys(self):
+        keys = super()._keys()
+        if self._lock is True:
+            # made on first use, see ValueProxy
+            keys += synchronize.RLock._keys_of(self._oid + '-lock')
+        return keys
+
+    def _make_lock(self):
+        return synchronize.RLock(name=self._oid + '-lock', client=self._client)
+
+    def _index(self, i):
+        idx = i.__index__()
+        if idx < 0:
+            idx += self._length
+        if not 0 <= idx < self._length:
+            raise IndexError('array index out of range')
+        return idx * self._itemsize
+
+    def _unpack(self, data):
+        values = array.array(self._typecode)
+        values.frombytes(data)
+        return values
+
+    def __len__(self):
+        return self._length
+
+    @_unbatched
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._length)
+            if (step > 0 and start >= stop) or (step < 0 and start <= stop):
+                return array.array(self._typecode)
+            # fetch the covering byte range once, then pick elements
+            low, high = (start, stop - 1) if step > 0 else (stop + 1, start)
+            data = self._client.getrange(self._oid, low * self._itemsize,
+                                         (high + 1) * self._itemsize - 1)
+            values = self._unpack(data)
+            if step == 1:
+                return values
+            return values[start - low::step]
+
+        if isinstance(i, int) or hasattr(i, '__index__'):
+            offset = self._index(i)
+            data = self._client.getrange(self._oid, offset,
+                                         offset + self._itemsize - 1)
+            return self._unpack(data)[0]
+
+        raise TypeError('array indices must be integers '
+                        'or slices, not {}'.format(type(i).__name__))
+
+    @_unbatched
+    def __setitem__(self, i, obj):
+        if isinstance(i, slice):
+            indices = range(*i.indices(self._length))
+            values = array.array(self._typecode, obj)
+            if len(values) != len(indices):
+                raise ValueError('Can only assign sequence of same size')
+            if not indices:
+                return
+            if indices.step == 1:
+                self._client.setrange(self._oid,
+                                      indices.start * self._itemsize,
+                                      values.tobytes())
+                return
+            pipeline = self._client.pipeline(transaction=False)
+            for idx, value in zip(indices, values):
+                pipeline.setrange(self._oid, idx * self._itemsize,
+                                  array.array(self._typecode,
+                                              [value]).tobytes())
+            pipeline.execute()
+            return
+
+        if isinstance(i, int) or hasattr(i, '__index__'):
+            offset = self._index(i)
+            self._client.setrange(self._oid, offset,
+                                  array.array(self._typecode, [obj]).tobytes())
+            return
+
+        raise TypeError('array indices must be integers '
+                        'or slices, not {}'.format(type(i).__name__))
+
+    @_unbatched
+    def __iter__(self):
+        return iter(self.toarray())
+
+    @_unbatched
+    def toarray(self):
+        return self._unpack(self._client.get(self._oid) or b'')
+
+    @_unbatched
+    def tolist(self):
+        return self.toarray().tolist()
+
+    def get_lock(self):
+        if self._lock is None:
+            raise AttributeError("'%s' object has no attribute 'get_lock'"
+                                 % type(self).__name__)
+        if self._lock is True:
+            self._lock = self._make_lock()
+        return self._lock
 
-class ArrayProxy(ListProxy):
-    def __init__(self, typecode, sequence, lock=True):
-        super().__init__(sequence)
-        
 
 #
 # Definition of SyncManager
@@ -611,6 +1496,7 @@ SyncManager.register('RLock', synchronize.RLock)
 SyncManager.register('Semaphore', synchronize.Semaphore)
 SyncManager.register('BoundedSemaphore', synchronize.BoundedSemaphore)
 SyncManager.register('Condition', synchronize.Condition)
+SyncManager.register('RWLock', synchronize.RWLock)
 SyncManager.register('Barrier', synchronize.Barrier)
 SyncManager.register('Pool', pool.Pool, can_manage=False)
 SyncManager.register('list', ListProxy)
@@ -19,8 +19,10 @@ import queue
 import itertools
 import collections
 import time
+import statistics
 import traceback
 from lithops import FunctionExecutor
+from lithops.wait import ANY_COMPLETED, ALWAYS
 
 # If threading is available then ThreadPool should be provided.  Therefore
 # we avoid top-level imports which are liable to fail on some systems.
@@ -41,12 +43,41 @@ TERMINATE = 2
 
 job_counter = itertools.count()
 
+# Speculative execution of straggler invocations (see `Pool`): once this
+# fraction of the tasks of a map is done, tasks running for longer than
+# SPECULATIVE_FACTOR times the median task time are launched again
+SPECULATIVE_QUANTILE = 0.75
+SPECULATIVE_FACTOR = 2.0
+# Seconds between two checks for stragglers
+SPECULATIVE_INTERVAL = 1.0
+
+# Maximum number of `apply_async` calls coalesced into one job
+COALESCE_MAX = 100
+
+# Items of an input without length read before choosing the chunksize
+# of a map over it, shorter inputs are batched like a list would be
+STREAM_READAHEAD = 1000
+
+def _call(func, args):
+    # Bind the arguments of a map item the same way the executor does
+    # for unbatched items, so results do not depend on the chunksize
+    if isinstance(args, dict):
+        return func(**args)
+    if isinstance(args, tuple):
+        return func(*args)
+    return func(args)
+
 def mapstar(args):
-    return list(map(*args))
+    func, batch = args
+    return [_call(func, x) for x in batch]
 
 def starmapstar(args):
     return list(itertools.starmap(args[0], args[1]))
 
+def applystar(args):
+    func, args, kwds = args
+    return func(*args, **kwds)
+
 #
 # Hack to embed stringification of remote traceback in local traceback
 #
@@ -155,7 +186,10 @@ class Pool(object):
         return self._ctx.Process(*args, **kwds)
 
     def __init__(self, processes=None, initializer=None, initargs=(),
-                 maxtasksperchild=None, context=None):
+                 maxtasksperchild=None, context=None, *, speculative=False,
+                 speculative_quantile=SPECULATIVE_QUANTILE,
+                 speculative_factor=SPECULATIVE_FACTOR,
+                 coalesce_window=None, coalesce_max=COALESCE_MAX):
         self._ctx = context or get_context()
         #self._setup_queues()
         self._taskqueue = queue.Queue()
@@ -168,6 +202,27 @@ class Pool(object):
         if processes is not None and processes < 1:
             raise ValueError("Number of processes must be at least 1")
 
+        if not 0 < speculative_quantile <= 1:
+            raise ValueError("speculative_quantile must be in (0, 1]")
+        if speculative_factor <= 0:
+            raise ValueError("speculative_factor must be positive")
+        self._speculative = speculative
+        self._speculative_quantile = speculative_quantile
+        self._speculative_factor = speculative_factor
+
+        # apply_async calls made within `coalesce_window` seconds of each
+        # other, up to `coalesce_max` of them, are submitted as one job
+        if coalesce_max < 1:
+            raise ValueError("coalesce_max must be at least 1")
+        self._coalesce_window = coalesce_window
+        self._coalesce_max = coalesce_max
+        self._coalesced = []
+        self._coalesce_timer = None
+        self._coalesce_lock = threading.Lock()
+        # the executor is not thread-safe, and jobs are submitted from
+        # the coalescing timer, stream handlers and speculative waits
+        self._submit_lock = threading.Lock()
+
         if processes is not None:
             if self._initargs:
                 self._executor = FunctionExecutor(workers=processes, **self._initargs)
@@ -265,6 +320,14 @@ class Pool(object):
         self._quick_put = self._inqueue._writer.send
         self._quick_get = self._outqueue._reader.recv
 
+    def _map(self, func, iterdata):
+        with self._submit_lock:
+            return self._executor.map(func, iterdata)
+
+    def _call_async(self, func, data):
+        with self._submit_lock:
+            return self._executor.call_async(func, data)
+
     def apply(self, func, args=(), kwds={}):
         '''
         Equivalent of `func(*args, **kwds)`.
@@ -306,59 +369,150 @@ class Pool(object):
         except Exception as e:
             yield (result_job, i+1, _helper_reraises_exception, (e,), {})
 
-    def imap(self, func, iterable, chunksize=1):
+    def imap(self, func, iterable, chunksize=1, window=None):
         '''
         Equivalent of `map()` -- can be MUCH slower than `Pool.map()`.
+
+        The iterable is consumed as invocations are submitted, keeping at
+        most `window` invocations in flight (the pool size by default).
         '''
         if self._state != RUN:
             raise ValueError("Pool not running")
-        if chunksize == 1:
-            result = IMapIterator(self._cache)
-            self._taskqueue.put(
-                (
-                    self._guarded_task_generation(result._job, func, iterable),
-                    result._set_length
-                ))
-            return result
-        else:
-            assert chunksize > 1
-            task_batches = Pool._get_tasks(func, iterable, chunksize)
-            result = IMapIterator(self._cache)
-            self._taskqueue.put(
-                (
-                    self._guarded_task_generation(result._job,
-                                                  mapstar,
-                                                  task_batches),
-                    result._set_length
-                ))
-            return (item for chunk in result for item in chunk)
-
-    def imap_unordered(self, func, iterable, chunksize=1):
+        result = IMapIterator(self._cache)
+        return self._start_imap(result, func, iterable, chunksize, window)
+
+    def imap_unordered(self, func, iterable, chunksize=1, window=None):
         '''
-        Like `imap()` method but ordering of results is arbitrary.
+        Like `imap()` method but results are yielded as they complete.
         '''
         if self._state != RUN:
             raise ValueError("Pool not running")
+        result = IMapUnorderedIterator(self._cache)
+        return self._start_imap(result, func, iterable, chunksize, window)
+
+    def _start_imap(self, result, func, iterable, chunksize, window):
+        assert chunksize >= 1
         if chunksize == 1:
-            result = IMapUnorderedIterator(self._cache)
-            self._taskqueue.put(
-                (
-                    self._guarded_task_generation(result._job, func, iterable),
-                    result._set_length
-                ))
-            return result
+            # unwrap the single item batches
+            def set_result(i, obj):
+                success, value = obj
+                result._set(i, (True, value[0]) if success else obj)
         else:
-            assert chunksize > 1
-            task_batches = Pool._get_tasks(func, iterable, chunksize)
-            result = IMapUnorderedIterator(self._cache)
-            self._taskqueue.put(
-                (
-                    self._guarded_task_generation(result._job,
-                                                  mapstar,
-                                                  task_batches),
-                    result._set_length
-                ))
-            return (item for chunk in result for item in chunk)
+            set_result = result._set
+
+        handler = threading.Thread(
+            target=self._handle_stream,
+            args=(func, iterable, chunksize, mapstar,
+                  window or self._processes, set_result, result._set_length),
+            name='PoolStreamHandler'
+            )
+        handler.daemon = True
+        handler.start()
+
+        if chunksize == 1:
+            return result
+        return (item for chunk in result for item in chunk)
+
+    def _handle_stream(self, func, iterable, chunksize, mapper, window,
+                       set_result, set_length):
+        '''
+        Submit the batches of `iterable` while it is being read, keeping
+        at most `window` invocations in flight, and pass each batch result
+        to `set_result` as soon as its invocation completes.
+
+        Invocations are submitted in jobs of at least half the window.
+        Without a `chunksize`, it is chosen from the first items read.
+        '''
+        if chunksize is None:
+            iterable, chunksize = self._read_ahead(iterable)
+        batches = Pool._get_tasks(func, iterable, chunksize)
+        pending = {}
+        count = 0
+        exhausted = False
+
+        try:
+            while pending or not exhausted:
+                if self._state == TERMINATE:
+                    raise ValueError("Pool terminated")
+
+                if not exhausted and len(pending) <= window // 2:
+                    wanted = window - len(pending)
+                    new = []
+                    error = None
+                    try:
+                        for batch in itertools.islice(batches, wanted):
+                            new.append(batch)
+                    except Exception as e:
+                        error = e
+
+                    if new:
+                        futures = self._map(mapper,
+                                            [(batch, ) for batch in new])
+                        for future in futures:
+                            pending[future] = count
+                            count += 1
+
+                    if error is not None:
+                        set_result(count, (False, error))
+                        count += 1
+                    if error is not None or len(new) < wanted:
+                        exhausted = True
+                        util.debug('doing set_length()')
+                        set_length(count)
+
+                if not pending:
+                    continue
+
+                done, _ = self._executor.wait(list(pending), throw_except=False,
+                                              return_when=ANY_COMPLETED,
+                                              download_results=True)
+                for future in done:
+                    i = pending.pop(future)
+                    try:
+                        set_result(i, (True, future.result()))
+                    except Exception as e:
+                        set_result(i, (False, e))
+        except Exception as e:
+            util.debug('stream handler got exception: %r' % e)
+            # the results still pending will never be collected
+            for i in pending.values():
+                set_result(i, (False, e))
+            if not exhausted:
+                set_result(count, (False, e))
+                count += 1
+        finally:
+            if not exhausted:
+                util.debug('doing set_length()')
+                set_length(count)
+
+        util.debug('stream handler exiting')
+
+    def _read_ahead(self, iterable):
+        '''
+        Read the first items of `iterable` to size its batches as
+        `_map_async` would for that many items, return an iterable
+        with every item and the chunksize.
+        '''
+        it = iter(iterable)
+        head = []
+        error = None
+        try:
+            for x in itertools.islice(it, STREAM_READAHEAD):
+                head.append(x)
+        except Exception as e:
+            # raised when the batches get to it
+            error = e
+
+        chunksize, extra = divmod(len(head), self._processes * 4)
+        if extra:
+            chunksize += 1
+
+        def items():
+            yield from head
+            if error is not None:
+                raise error
+            yield from it
+        return items(), max(chunksize, 1)
 
     def apply_async(self, func, args=(), kwds={}, callback=None,
                     error_callback=None):
@@ -368,12 +522,53 @@ class Pool(object):
         if self._state != RUN:
             raise ValueError("Pool not running")
 
-        futures = self._executor.call_async(func, [*args, *kwds])
+        if self._coalesce_window is not None:
+            return self._coalesce(func, args, kwds, callback, error_callback)
+
+        # bound by applystar, the same as coalesced calls
+        futures = self._call_async(applystar,
+                                   ((func, tuple(args), dict(kwds)), ))
 
         result = ApplyResult(self._executor, [futures], callback, error_callback)
 
         return result
 
+    def _coalesce(self, func, args, kwds, callback, error_callback):
+        result = ApplyResult(self._executor, None, callback, error_callback)
+        with self._coalesce_lock:
+            self._coalesced.append(((func, tuple(args), dict(kwds)), result))
+            full = len(self._coalesced) >= self._coalesce_max
+            if not full and self._coalesce_timer is None:
+                self._coalesce_timer = threading.Timer(
+                    self._coalesce_window, self._flush_coalesced)
+                self._coalesce_timer.daemon = True
+                self._coalesce_timer.start()
+        if full:
+            self._flush_coalesced()
+        return result
+
+    def _flush_coalesced(self):
+        '''
+        Submit the pending coalesced calls as a single executor job
+        '''
+        with self._coalesce_lock:
+            calls, self._coalesced = self._coalesced, []
+            if self._coalesce_timer is not None:
+                self._coalesce_timer.cancel()
+                self._coalesce_timer = None
+        if not calls:
+            return
+
+        util.debug('submitting %d coalesced calls' % len(calls))
+        try:
+            futures = self._map(applystar, [(task, ) for task, _ in calls])
+        except Exception as e:
+            for _, result in calls:
+                result._set_futures(None, e)
+            return
+        for (_, result), future in zip(calls, futures):
+            result._set_futures([future])
+
     def map_async(self, func, iterable, chunksize=None, callback=None,
                   error_callback=None):
         '''
@@ -390,14 +585,54 @@ class Pool(object):
         if self._state != RUN:
             raise ValueError("Pool not running")
         if not hasattr(iterable, '__len__'):
-            iterable = list(iterable)
+            return self._map_stream(func, iterable, mapper, chunksize,
+                                    callback, error_callback)
+
+        if chunksize is None:
+            chunksize, extra = divmod(len(iterable), self._processes * 4)
+            if extra:
+                chunksize += 1
+        if len(iterable) == 0:
+            chunksize = 0
+
+        # each batch runs in a single invocation
+        task_batches = [(batch, ) for batch in
+                        Pool._get_tasks(func, iterable, chunksize)]
+        if task_batches:
+            futures = self._map(mapper, task_batches)
+        else:
+            futures = []
 
-        futures = self._executor.map(func, iterable)
+        speculation = None
+        if self._speculative and futures:
+            speculation = (self._speculative_quantile,
+                           self._speculative_factor, self._map, mapper,
+                           task_batches)
 
-        result = MapResult(self._executor, futures, callback, error_callback)
+        result = MapResult(self._executor, futures, callback, error_callback,
+                           speculation)
 
         return result
 
+    def _map_stream(self, func, iterable, mapper, chunksize=None,
+                    callback=None, error_callback=None):
+        '''
+        Map over an iterable of unknown length without materializing it.
+        The input is read one window of batches at a time while the
+        previous ones run, and the results are stitched back in order.
+        '''
+        # as many batches in flight as _map_async makes
+        result = MapStreamResult(self._executor, callback, error_callback)
+        handler = threading.Thread(
+            target=self._handle_stream,
+            args=(func, iterable, chunksize, mapper, self._processes * 4,
+                  result._set, result._set_length),
+            name='PoolStreamHandler'
+            )
+        handler.daemon = True
+        handler.start()
+        return result
+
     @staticmethod
     def _handle_workers(pool):
         thread = threading.current_thread()
@@ -536,12 +771,14 @@ class Pool(object):
         if self._state == RUN:
             self._state = CLOSE
             #self._worker_handler._state = CLOSE
+            self._flush_coalesced()
 
     def terminate(self):
         util.debug('terminating pool')
         self._state = TERMINATE
         #self._worker_handler._state = TERMINATE
         #self._terminate()
+        self._flush_coalesced()
         self._executor.clean()
 
     def join(self):
@@ -627,8 +864,22 @@ class ApplyResult(object):
         self._executor = executor
         self._callback = callback
         self._error_callback = error_callback
+        self._submit_error = None
+        # futures may be set later on by a coalesced submission
+        self._submitted = threading.Event()
+        if futures is not None:
+            self._submitted.set()
+
+    def _set_futures(self, futures, error=None):
+        self._futures = futures
+        self._submit_error = error
+        self._submitted.set()
 
     def ready(self):
+        if not self._submitted.is_set():
+            return False
+        if self._submit_error is not None:
+            return True
         return self._futures[0].ready
 
     def successful(self):
@@ -636,11 +887,34 @@ class ApplyResult(object):
         return self._success
 
     def wait(self, timeout=None):
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if not self._submitted.wait(timeout):
+            return
+        if self._submit_error is not None:
+            return
+        # waiting on no futures would wait for every future of the executor
+        if not self._futures:
+            return
+        if timeout is not None:
+            timeout = max(deadline - time.monotonic(), 0)
         self._executor.wait(self._futures, download_results=True, timeout=timeout)
 
     def get(self, timeout=None):
         self.wait(timeout)
-        self._value = self._executor.get_result(self._futures)
+        if not self._submitted.is_set():
+            raise TimeoutError
+
+        try:
+            if self._submit_error is not None:
+                raise self._submit_error
+            # executor.get_result() only unwraps single results of
+            # call_async jobs, coalesced calls come from a map
+            self._value = self._futures[0].result()
+        except Exception as e:
+            if self._error_callback is not None:
+                self._error_callback(e)
+            raise
 
         if self._callback is not None:
             self._callback(self._value)
@@ -666,12 +940,207 @@ AsyncResult = ApplyResult  # create alias -- see #17805
 # Class whose instances are returned by `Pool.map_async()`
 #
 
+def _is_finished(future):
+    return future.ready or future.done
+
+def _pick_winner(original, copy):
+    # the first attempt of a task that succeeded, or the original
+    # once every attempt failed
+    attempts = [original] if copy is None else [original, copy]
+    for future in attempts:
+        if _is_finished(future) and not future.error:
+            return future
+    if all(_is_finished(future) for future in attempts):
+        return original
+    return None
+
+def _start_time(future):
+    # worker time at which the invocation started, None while queued
+    started = future.stats.get('worker_start_tstamp')
+    if started is None and future._call_status:
+        started = future._call_status.get('worker_start_tstamp')
+    return started
+
+def _run_time(future):
+    stats = future.stats
+    if 'worker_start_tstamp' not in stats or 'worker_end_tstamp' not in stats:
+        return None
+    return stats['worker_end_tstamp'] - stats['worker_start_tstamp']
+
+
 class MapResult(ApplyResult):
 
-    def __init__(self, executor, futures, callback, error_callback):
+    def __init__(self, executor, futures, callback, error_callback,
+                 speculation=None):
         ApplyResult.__init__(self, executor, futures, callback, error_callback)
 
         self._value = [None] * len(futures)
+        self._speculation = speculation
+        # kept between waits, so that a wait that timed out
+        # does not launch the same copies again
+        self._copies = {}       # task index -> speculative copy
+        self._winners = {}      # task index -> future whose result is used
+        self._durations = []    # run times of the finished tasks
+        # speculative copies launched and copies whose result was used
+        self.speculation_stats = {'launched': 0, 'used': 0}
+
+    def ready(self):
+        if self._speculation is not None:
+            return len(self._winners) == len(self._futures)
+        return all(f.ready or f.done for f in self._futures)
+
+    def wait(self, timeout=None):
+        if self._speculation is None:
+            return ApplyResult.wait(self, timeout)
+        self._wait_speculating(timeout)
+
+    def _wait_speculating(self, timeout=None):
+        '''
+        Wait for every task, launching a copy of the tasks that run for
+        much longer than the rest. The first copy of a task to finish
+        without error wins.
+        '''
+        quantile, factor, submit, mapper, task_batches = self._speculation
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        n = len(self._futures)
+        copies = self._copies
+        winners = self._winners
+
+        while len(winners) < n:
+            running = [f for i, f in enumerate(self._futures)
+                       if i not in winners]
+            running.extend(f for i, f in copies.items() if i not in winners)
+            self._executor.wait(running, throw_except=False,
+                                return_when=ALWAYS)
+
+            for i, future in enumerate(self._futures):
+                if i in winners:
+                    continue
+                winner = _pick_winner(future, copies.get(i))
+                if winner is None:
+                    continue
+                winners[i] = winner
+                duration = _run_time(winner)
+                if duration is not None:
+                    self._durations.append(duration)
+                if winner is not future:
+                    self.speculation_stats['used'] += 1
+
+            if len(winners) == n:
+                break
+
+            if len(winners) >= quantile * n and self._durations:
+                # worker clock times: a task still queued is no straggler
+                limit = factor * statistics.median(self._durations)
+                now = time.time()
+                stragglers = []
+                for i, future in enumerate(self._futures):
+                    if i in winners or i in copies:
+                        continue
+                    started = _start_time(future)
+                    if started is not None and now - started > limit:
+                        stragglers.append(i)
+                if stragglers:
+                    util.debug('launching %d speculative tasks' % len(stragglers))
+                    futures = submit(
+                        mapper, [task_batches[i] for i in stragglers])
+                    for i, future in zip(stragglers, futures):
+                        copies[i] = future
+                    self.speculation_stats['launched'] += len(stragglers)
+
+            waittime = SPECULATIVE_INTERVAL
+            if timeout is not None:
+                waittime = min(waittime, deadline - time.monotonic())
+                if waittime <= 0:
+                    return
+            time.sleep(waittime)
+
+        self._futures = [winners[i] for i in range(n)]
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError
+        # every future holds the results of a batch of items, read them
+        # directly as get_result() unwraps single results depending on
+        # the last call made to the executor
+        try:
+            chunks = [f.result() for f in self._futures]
+        except Exception as e:
+            if self._error_callback is not None:
+                self._error_callback(e)
+            raise
+        self._value = list(itertools.chain.from_iterable(chunks))
+
+        if self._callback is not None:
+            self._callback(self._value)
+
+        return self._value
+
+
+#
+# Class whose instances are returned by `Pool.map_async()` when the
+# length of the input is not known
+#
+
+class MapStreamResult(ApplyResult):
+
+    def __init__(self, executor, callback, error_callback):
+        ApplyResult.__init__(self, executor, [], callback, error_callback)
+        self._cond = threading.Condition(threading.Lock())
+        self._chunks = {}
+        self._errors = {}
+        self._length = None
+
+    def _is_ready(self):
+        return self._length is not None and \
+            len(self._chunks) + len(self._errors) == self._length
+
+    def ready(self):
+        with self._cond:
+            return self._is_ready()
+
+    def successful(self):
+        assert self.ready()
+        return not self._errors
+
+    def wait(self, timeout=None):
+        with self._cond:
+            self._cond.wait_for(self._is_ready, timeout)
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError
+
+        if self._errors:
+            error = self._errors[min(self._errors)]
+            if self._error_callback is not None:
+                self._error_callback(error)
+            raise error
+
+        self._value = list(itertools.chain.from_iterable(
+            self._chunks[i] for i in range(self._length)))
+
+        if self._callback is not None:
+            self._callback(self._value)
+
+        return self._value
+
+    def _set(self, i, success_result):
+        success, value = success_result
+        with self._cond:
+            if success:
+                self._chunks[i] = value
+            else:
+                self._errors[i] = value
+            self._cond.notify_all()
+
+    def _set_length(self, length):
+        with self._cond:
+            self._length = length
+            self._cond.notify_all()
 
 
 #
@@ -14,12 +14,124 @@
 # limitations under the License.
 #
 
+import threading
+import time
+import weakref
+
 from lithops import FunctionExecutor
 from lithops.wait import ALL_COMPLETED, ALWAYS
 
 from . import util
 
-__all__ = ['Popen']
+__all__ = ['Popen', 'wait_sentinels']
+
+#
+# Constants
+#
+
+# Seconds a launch waits for other processes to be started with it
+LAUNCH_WINDOW = 0.02
+# Maximum number of processes launched in a single job
+LAUNCH_MAX = 500
+# Seconds between two status checks while waiting for a process
+POLL_INTERVAL = 1.0
+
+#
+# Executor shared by every process started from this one
+#
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = FunctionExecutor()
+        return _executor
+
+
+def _run_process(task):
+    target, args, kwargs = task
+    return target(*args, **kwargs)
+
+
+class _Launcher(object):
+    '''
+    Buffers the processes started in quick succession and launches them
+    together as a single multi-call job
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    def launch(self, popen, task):
+        with self._lock:
+            self._pending.append((popen, task))
+            full = len(self._pending) >= LAUNCH_MAX
+            if not full and self._timer is None:
+                self._timer = threading.Timer(LAUNCH_WINDOW, self._flush_later)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _flush_later(self):
+        # the processes of a failed launch get the error themselves,
+        # there is no one to raise it to on the timer thread
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not pending:
+                return
+            # launched under the lock so that a popen found missing
+            # from the buffer already has its sentinel
+            util.debug('launching %d processes' % len(pending))
+            try:
+                futures = get_executor().map(
+                    _run_process, [(task, ) for _, task in pending])
+            except Exception as e:
+                util.debug('launching processes failed: %r' % e)
+                for popen, _ in pending:
+                    popen._set_launch_error(e)
+                raise
+            for (popen, _), future in zip(pending, futures):
+                popen._sentinel = future
+                _running.add(popen)
+
+
+_launcher = _Launcher()
+
+# launched processes which have not finished yet
+_running = weakref.WeakSet()
+_last_refresh = None
+_refresh_lock = threading.Lock()
+
+def _refresh_status():
+    '''
+    Update the status of every running process with one status query,
+    at most once every POLL_INTERVAL seconds
+    '''
+    global _last_refresh
+    with _refresh_lock:
+        now = time.monotonic()
+        if _last_refresh is not None and now - _last_refresh < POLL_INTERVAL:
+            return
+        _last_refresh = now
+        sentinels = [p._sentinel for p in list(_running)
+                     if p.returncode is None]
+        if sentinels:
+            get_executor().wait(sentinels, throw_except=False,
+                                return_when=ALWAYS)
 
 
 #
@@ -32,28 +144,74 @@ class Popen(object):
     def __init__(self, process_obj):
         util._flush_std_streams()
         self.returncode = None
-        self._executor = FunctionExecutor()
+        self._sentinel = None
+        self._launch_error = None
+        self._executor = get_executor()
         self._launch(process_obj)
 
     def duplicate_for_child(self, fd):
         return fd
 
+    def _set_launch_error(self, error):
+        self._launch_error = error
+        self.returncode = 1
+
+    def _ensure_launched(self):
+        if self._sentinel is None and self._launch_error is None:
+            try:
+                _launcher.flush()
+            except Exception:
+                # only our own launch failure is of interest here
+                pass
+        if self._launch_error is not None:
+            raise self._launch_error
+
+    @property
+    def sentinel(self):
+        self._ensure_launched()
+        return self._sentinel
+
+    def _update_returncode(self):
+        sentinel = self._sentinel
+        if sentinel is None:
+            # still waiting to be launched
+            return
+        if sentinel.ready or sentinel.done:
+            self.returncode = 0
+        if sentinel.error:
+            self.returncode = 1
+        if self.returncode is not None:
+            _running.discard(self)
+
     def poll(self, flag=ALWAYS):
         if self.returncode is None:
-            self._executor.wait([self.sentinel], return_when=flag)
-            if self.sentinel.ready or self.sentinel.done:
-                self.returncode = 0
-            if self.sentinel.error:
-                self.returncode = 1
+            self._update_returncode()
+        if self.returncode is None and self._sentinel is not None:
+            if flag == ALWAYS:
+                _refresh_status()
+            else:
+                self._executor.wait([self._sentinel], throw_except=False,
+                                    return_when=flag)
+            self._update_returncode()
         return self.returncode
 
     def wait(self, timeout=None):
+        if self._launch_error is not None:
+            raise self._launch_error
         if self.returncode is None:
-            wait = self._executor.wait
-            if not wait([self.sentinel], timeout=timeout):
-                return None
-            # This shouldn't block if wait() returned successfully.
-            return self.poll(ALWAYS if timeout == 0.0 else ALL_COMPLETED)
+            if timeout is not None:
+                deadline = time.monotonic() + timeout
+            # every round checks all running processes at once, so
+            # joining many processes in a row costs one query per round
+            self._ensure_launched()
+            while self.poll() is None:
+                if timeout is None:
+                    waittime = POLL_INTERVAL
+                else:
+                    waittime = min(deadline - time.monotonic(), POLL_INTERVAL)
+                    if waittime <= 0:
+                        return None
+                time.sleep(waittime)
         return self.returncode
 
     def terminate(self):
@@ -64,5 +222,36 @@ class Popen(object):
                 pass
 
     def _launch(self, process_obj):
-        fn_args = [*process_obj._args, *process_obj._kwargs]
-        self.sentinel = self._executor.call_async(process_obj._target, fn_args)
+        task = (process_obj._target, process_obj._args, process_obj._kwargs)
+        _launcher.launch(self, task)
+
+
+def _is_done(sentinel):
+    return sentinel.ready or sentinel.done or sentinel.error
+
+
+def wait_sentinels(sentinels, timeout=None):
+    '''
+    Wait till any of the process sentinels is done.
+
+    The status of all of them is checked with a single query per round.
+    Returns the list of those sentinels which are done.
+    '''
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+
+    while True:
+        ready = [s for s in sentinels if _is_done(s)]
+        if ready:
+            return ready
+        get_executor().wait(sentinels, throw_except=False, return_when=ALWAYS)
+        ready = [s for s in sentinels if _is_done(s)]
+        if ready:
+            return ready
+
+        waittime = POLL_INTERVAL
+        if timeout is not None:
+            waittime = min(deadline - time.monotonic(), waittime)
+            if waittime <= 0:
+                return []
+        time.sleep(waittime)
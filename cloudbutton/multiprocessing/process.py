@@ -106,7 +106,6 @@ class BaseProcess(object):
                'daemonic processes are not allowed to have children'
         _cleanup()
         self._popen = self._Popen(self)
-        self._sentinel = self._popen.sentinel
         # Avoid a refcycle if the target function holds an indirect
         # reference to the process object (see bpo-30775)
         del self._target, self._args, self._kwargs
@@ -208,10 +207,10 @@ class BaseProcess(object):
         Return a file descriptor (Unix) or handle (Windows) suitable for
         waiting for process termination.
         '''
-        try:
-            return self._sentinel
-        except AttributeError:
+        # the sentinel may only exist once a batch of processes is launched
+        if self._popen is None:
             raise ValueError("process not started")
+        return self._popen.sentinel
 
     def __repr__(self):
         if self is _current_process:
@@ -30,28 +30,127 @@ _ForkingPickler = context.reduction.ForkingPickler
 
 from .util import debug, info, Finalize, register_after_fork, is_exiting
 
+#
+# Constants
+#
+
+# Maximum number of items sent per round trip
+BATCH_SIZE = 1000
+# Seconds the feeder thread waits for a batch to fill up before sending
+FEEDER_LINGER = 0.0
+
+def _in_cloud_worker():
+    # set by lithops in the functions it runs
+    return 'LITHOPS_EXECUTION_ID' in os.environ
+
 #
 # Queue type using a pipe, buffer and thread
 #
 
 class Queue:
 
-    def __init__(self):
+    # KEYS[1] - queue list
+    # KEYS[2] - not-full wake-up list
+    # ARGV[1] - max size
+    # ARGV[2...] - values
+    # return how many values were pushed (as many
+    # as fit), leaving a wake-up token if there is still
+    # room so that other blocked producers can go on
+    LUA_BOUNDED_PUSH_SCRIPT = """
+        local maxsize = tonumber(ARGV[1])
+        local size = tonumber(redis.call('llen', KEYS[1]))
+        local n = math.min(maxsize - size, #ARGV - 1)
+        if n <= 0 then
+            return 0
+        end
+        redis.call('rpush', KEYS[1], unpack(ARGV, 2, n + 1))
+        if size + n < maxsize and redis.call('llen', KEYS[2]) == 0 then
+            redis.call('rpush', KEYS[2], '')
+        end
+        return n
+    """
+
+    # KEYS[1] - queue list
+    # KEYS[2] - not-full wake-up list
+    # return the popped value, if any, and
+    # wake up one producer blocked on a full queue
+    LUA_BOUNDED_POP_SCRIPT = """
+        local value = redis.call('lpop', KEYS[1])
+        if value and redis.call('llen', KEYS[2]) == 0 then
+            redis.call('rpush', KEYS[2], '')
+        end
+        return value
+    """
+
+    # KEYS[1] - queue list
+    # KEYS[2] - not-full wake-up list (optional)
+    # ARGV[1] - max number of values
+    # return up to ARGV[1] values popped at once
+    # (works on servers without LPOP count)
+    LUA_POP_MANY_SCRIPT = """
+        local values = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+        if #values > 0 then
+            redis.call('ltrim', KEYS[1], #values, -1)
+            if KEYS[2] and redis.call('llen', KEYS[2]) == 0 then
+                redis.call('rpush', KEYS[2], '')
+            end
+        end
+        return values
+    """
+
+    # KEYS[1] - queue list
+    # KEYS[2] - not-full wake-up list
+    # ARGV[1] - max size
+    LUA_NOTIFY_NOT_FULL_SCRIPT = """
+        if tonumber(redis.call('llen', KEYS[1])) < tonumber(ARGV[1])
+            and redis.call('llen', KEYS[2]) == 0 then
+            redis.call('rpush', KEYS[2], '')
+        end
+    """
+
+    def __init__(self, maxsize=0, *, batch_size=BATCH_SIZE,
+                 linger=FEEDER_LINGER):
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
         self._reader, self._writer = connection.Pipe(duplex=False)
         self._opid = os.getpid()
-        
+        self._maxsize = maxsize if maxsize > 0 else 0
+        self._batch_size = batch_size
+        self._linger = linger
+        self._notfull_handle = self._reader._subhandle + '-notfull'
+
+        client = self._reader._client
+        self._lua_push = client.register_script(Queue.LUA_BOUNDED_PUSH_SCRIPT)
+        self._lua_pop = client.register_script(Queue.LUA_BOUNDED_POP_SCRIPT)
+        self._lua_pop_many = client.register_script(Queue.LUA_POP_MANY_SCRIPT)
+        self._lua_notify = client.register_script(
+            Queue.LUA_NOTIFY_NOT_FULL_SCRIPT)
+        util.make_stateless_script(self._lua_push)
+        util.make_stateless_script(self._lua_pop)
+        util.make_stateless_script(self._lua_pop_many)
+        util.make_stateless_script(self._lua_notify)
+
+        self._ref = util.RemoteReference(
+            referenced=[self._reader._handle, self._reader._subhandle,
+                        self._notfull_handle],
+            client=client)
+
         # For use by concurrent.futures
         self._ignore_epipe = False
 
         self._after_fork()
 
     def __getstate__(self):
-        return (self._ignore_epipe,  self._reader, 
-                self._writer, self._opid, self._ref)
+        return (self._ignore_epipe,  self._reader, self._writer,
+                self._opid, self._ref, self._maxsize, self._batch_size,
+                self._linger, self._notfull_handle, self._lua_push,
+                self._lua_pop, self._lua_pop_many, self._lua_notify)
 
     def __setstate__(self, state):
-        (self._ignore_epipe, self._reader,
-         self._writer, self._opid, self._ref) = state
+        (self._ignore_epipe, self._reader, self._writer,
+         self._opid, self._ref, self._maxsize, self._batch_size,
+         self._linger, self._notfull_handle, self._lua_push,
+         self._lua_pop, self._lua_pop_many, self._lua_notify) = state
         self._after_fork()
 
     def _after_fork(self):
@@ -64,19 +163,99 @@ class Queue:
         self._closed = False
         self._close = None
         self._send_bytes = self._writer.send_bytes
+        self._send_bytes_many = self._writer.send_bytes_many
         self._recv_bytes = self._reader.recv_bytes
         self._poll = self._reader.poll
+        # the feeder thread is a daemon and atexit handlers do not run
+        # in cloud workers, so the data put there would be lost when
+        # the function returns: send it synchronously instead
+        self._sync = _in_cloud_worker()
 
     def put(self, obj, block=True, timeout=None):
         assert not self._closed
 
+        if self._maxsize:
+            if self._put_bounded([obj], block, timeout):
+                raise Full
+            return
+
+        if self._sync:
+            self._send_now([obj])
+            return
+
         with self._notempty:
             if self._thread is None:
                 self._start_thread()
             self._buffer.append(obj)
             self._notempty.notify()
 
+    def put_many(self, iterable, block=True, timeout=None):
+        '''
+        Put every item of `iterable` into the queue. On a bounded queue
+        the items that fit are kept when `Full` is raised.
+        '''
+        assert not self._closed
+
+        if self._maxsize:
+            if self._put_bounded(list(iterable), block, timeout):
+                raise Full
+            return
+
+        if self._sync:
+            self._send_now(iterable)
+            return
+
+        with self._notempty:
+            if self._thread is None:
+                self._start_thread()
+            self._buffer.extend(iterable)
+            self._notempty.notify()
+
+    def _send_now(self, objs):
+        objs = [_ForkingPickler.dumps(obj) for obj in objs]
+        for i in range(0, len(objs), self._batch_size):
+            self._send_bytes_many(objs[i:i + self._batch_size])
+
+    def _put_bounded(self, objs, block, timeout):
+        # Bounded queues skip the feeder thread: the capacity check
+        # and the push are done atomically on the server, and blocked
+        # producers sleep on the not-full list until a consumer makes room.
+        # Returns the number of objects that could not be put
+        client = self._writer._client
+        keys = [self._writer._handle, self._notfull_handle]
+        objs = [bytes(_ForkingPickler.dumps(obj)) for obj in objs]
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        while objs:
+            n = self._lua_push(keys=keys,
+                               args=[self._maxsize, *objs[:self._batch_size]],
+                               client=client)
+            objs = objs[n:]
+            if n or not objs:
+                continue
+            if not block:
+                break
+            if timeout is None:
+                client.blpop([self._notfull_handle])
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or client.blpop(
+                        [self._notfull_handle],
+                        util._block_timeout(remaining)) is None:
+                    break
+        return len(objs)
+
     def get(self, block=True, timeout=None):
+        if self._maxsize:
+            res = self._lua_pop(keys=[self._reader._subhandle,
+                                      self._notfull_handle],
+                                client=self._reader._client)
+            if res is not None:
+                return _ForkingPickler.loads(res)
+            if not block:
+                raise Empty
+
         if block and timeout is None:
             res = self._recv_bytes()
         else:
@@ -87,8 +266,35 @@ class Queue:
                 raise Empty
             res = self._recv_bytes()
 
+        if self._maxsize:
+            self._lua_notify(keys=[self._reader._subhandle,
+                                   self._notfull_handle],
+                             args=[self._maxsize],
+                             client=self._reader._client)
+
         return _ForkingPickler.loads(res)
 
+    def get_many(self, max_items, timeout=None):
+        '''
+        Remove and return a list of up to `max_items` items, waiting
+        at most `timeout` seconds for the first one to arrive.
+        '''
+        keys = [self._reader._subhandle]
+        if self._maxsize:
+            keys.append(self._notfull_handle)
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        while True:
+            res = self._lua_pop_many(keys=keys, args=[max_items],
+                                     client=self._reader._client)
+            if res:
+                return [_ForkingPickler.loads(r) for r in res]
+            if timeout is not None:
+                timeout = max(deadline - time.monotonic(), 0.0)
+            if not self._poll(timeout):
+                raise Empty
+
     def qsize(self):
         return len(self._reader)
 
@@ -96,7 +302,7 @@ class Queue:
         return not self._poll()
 
     def full(self):
-        return False
+        return bool(self._maxsize) and self.qsize() >= self._maxsize
 
     def get_nowait(self):
         return self.get(False)
@@ -135,8 +341,10 @@ class Queue:
         self._buffer.clear()
         self._thread = threading.Thread(
             target=type(self)._feed,
-            args=(self._buffer, self._notempty, self._send_bytes,
-                  self._writer.close, self._ignore_epipe),
+            args=(self._buffer, self._notempty, self._send_bytes_many,
+                  self._writer.close, self._ignore_epipe,
+                  self._batch_size, self._linger,
+                  self._on_queue_feeder_error),
             name='QueueFeederThread'
             )
         self._thread.daemon = True
@@ -177,7 +385,8 @@ class Queue:
             notempty.notify()
 
     @staticmethod
-    def _feed(buffer, notempty, send_bytes, close, ignore_epipe):
+    def _feed(buffer, notempty, send_bytes_many, close, ignore_epipe,
+              batch_size, linger, onerror):
         debug('starting thread to feed data to pipe')
         nacquire = notempty.acquire
         nrelease = notempty.release
@@ -193,19 +402,36 @@ class Queue:
                         nwait()
                 finally:
                     nrelease()
-                try:
-                    while 1:
-                        obj = bpopleft()
-                        if obj is sentinel:
-                            debug('feeder thread got sentinel -- exiting')
-                            close()
-                            return
 
-                        obj = _ForkingPickler.dumps(obj)
-                        send_bytes(obj)
+                if linger and len(buffer) < batch_size:
+                    # give producers some time to fill the batch up
+                    time.sleep(linger)
 
-                except IndexError:
-                    pass
+                # This is the only thread popping from the buffer, so it
+                # cannot become empty between the check and the pop
+                while buffer:
+                    batch = []
+                    closing = False
+                    while buffer and len(batch) < batch_size:
+                        obj = bpopleft()
+                        if obj is sentinel:
+                            closing = True
+                            break
+                        # an object that cannot be pickled is reported
+                        # and dropped, the rest of the batch is sent
+                        try:
+                            batch.append(_ForkingPickler.dumps(obj))
+                        except Exception as e:
+                            onerror(e, obj)
+
+                    # one multi-value push per batch
+                    if batch:
+                        send_bytes_many(batch)
+
+                    if closing:
+                        debug('feeder thread got sentinel -- exiting')
+                        close()
+                        return
             except Exception as e:
                 if ignore_epipe and getattr(e, 'errno', 0) == errno.EPIPE:
                     return
@@ -220,6 +446,15 @@ class Queue:
                     import traceback
                     traceback.print_exc()
 
+    @staticmethod
+    def _on_queue_feeder_error(e, obj):
+        """
+        Private API hook called when feeding data in the background thread
+        raises an exception.  For overriding by concurrent.futures.
+        """
+        import traceback
+        traceback.print_exc()
+
 _sentinel = object()
 
 
@@ -235,6 +470,9 @@ class SimpleQueue:
         self._ref = util.RemoteReference(
             referenced=[self._reader._handle, self._reader._subhandle],
             client=self._reader._client)
+        self._lua_pop_many = self._reader._client.register_script(
+            Queue.LUA_POP_MANY_SCRIPT)
+        util.make_stateless_script(self._lua_pop_many)
 
     def _poll(self, timeout=0.0):
         return self._reader.poll(0.0)
@@ -244,10 +482,36 @@ class SimpleQueue:
         obj = _ForkingPickler.dumps(obj)
         self._writer.send_bytes(obj)
 
+    def put_many(self, iterable):
+        assert not self._closed
+        batch = []
+        for obj in iterable:
+            batch.append(_ForkingPickler.dumps(obj))
+            if len(batch) == BATCH_SIZE:
+                self._writer.send_bytes_many(batch)
+                batch = []
+        if batch:
+            self._writer.send_bytes_many(batch)
+
     def get(self):
         res = self._reader.recv_bytes()
         return _ForkingPickler.loads(res)
 
+    def get_many(self, max_items, timeout=None):
+        keys = [self._reader._subhandle]
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        while True:
+            res = self._lua_pop_many(keys=keys, args=[max_items],
+                                     client=self._reader._client)
+            if res:
+                return [_ForkingPickler.loads(r) for r in res]
+            if timeout is not None:
+                timeout = max(deadline - time.monotonic(), 0.0)
+            if not self._reader.poll(timeout):
+                raise Empty
+
     def qsize(self):
         return len(self._reader)
 
@@ -269,27 +533,51 @@ class SimpleQueue:
             self._closed = True
 
 
-Queue = SimpleQueue
-
 #
 # A queue type which also supports join() and task_done() methods
 #
 
-class JoinableQueue(SimpleQueue):
+class JoinableQueue(Queue):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, maxsize=0, **kwargs):
+        super().__init__(maxsize, **kwargs)
         self._unfinished_tasks = synchronize.Semaphore(0)
         self._cond = synchronize.Condition()
 
-    def put(self, obj):
-        with self._cond:
-            super().put(obj)
-            self._unfinished_tasks.release()
+    def __getstate__(self):
+        return Queue.__getstate__(self) + (self._cond, self._unfinished_tasks)
+
+    def __setstate__(self, state):
+        Queue.__setstate__(self, state[:-2])
+        self._cond, self._unfinished_tasks = state[-2:]
+
+    def put(self, obj, block=True, timeout=None):
+        # Count the task before it can be consumed. A bounded put may
+        # block, so the condition lock must not be held meanwhile
+        self._unfinished_tasks.release()
+        try:
+            super().put(obj, block, timeout)
+        except Full:
+            self._unfinished_tasks.acquire(False)
+            raise
+
+    def put_many(self, iterable, block=True, timeout=None):
+        assert not self._closed
+
+        objs = list(iterable)
+        self._unfinished_tasks.release(len(objs))
+        if self._maxsize:
+            left = self._put_bounded(objs, block, timeout)
+            if left:
+                # forget the tasks which could not be put
+                self._unfinished_tasks._try_acquire_many(left)
+                raise Full
+        else:
+            super().put_many(objs)
 
-    def task_done(self):
+    def task_done(self, n=1):
         with self._cond:
-            if not self._unfinished_tasks.acquire(False):
+            if not self._unfinished_tasks._try_acquire_many(n):
                 raise ValueError('task_done() called too many times')
             if self._unfinished_tasks.get_value() == 0:
                 self._cond.notify_all()
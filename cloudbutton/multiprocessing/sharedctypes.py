@@ -0,0 +1,369 @@
+#
+# Module which supports allocation of shared values and arrays
+#
+# multiprocessing/sharedctypes.py
+#
+# Copyright (c) 2006-2008, R Oudkerk
+# Licensed to PSF under a Contributor Agreement.
+#
+# Modifications Copyright (c) 2020 Cloudlab URV
+
+__all__ = ['RawValue', 'RawArray', 'Value', 'Array', 'SharedNDArray']
+
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from . import util
+from . import synchronize
+from .managers import ValueProxy, ArrayProxy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#
+# Constants
+#
+
+# Size in bytes of each stored piece of a SharedNDArray
+NDARRAY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# SharedNDArrays larger than this (bytes) are kept in object storage
+NDARRAY_STORAGE_THRESHOLD = 256 * 1024 * 1024
+
+# Concurrent object storage requests per transfer
+NDARRAY_STORAGE_WORKERS = 16
+
+#
+# Values and arrays
+#
+
+def RawValue(typecode_or_type, *args):
+    '''
+    Returns a shared object
+    '''
+    value = args[0] if args else None
+    return ValueProxy(typecode_or_type, value, lock=False)
+
+def RawArray(typecode_or_type, size_or_initializer):
+    '''
+    Returns a shared array
+    '''
+    return ArrayProxy(typecode_or_type, size_or_initializer, lock=False)
+
+def Value(typecode_or_type, *args, lock=True, ctx=None):
+    '''
+    Return a synchronization wrapper for a Value
+    '''
+    value = args[0] if args else None
+    return ValueProxy(typecode_or_type, value, lock=lock)
+
+def Array(typecode_or_type, size_or_initializer, *, lock=True, ctx=None):
+    '''
+    Return a synchronization wrapper for a RawArray
+    '''
+    return ArrayProxy(typecode_or_type, size_or_initializer, lock=lock)
+
+#
+# NumPy arrays
+#
+
+class SharedNDArray:
+    '''
+    NumPy array shared across processes.
+
+    The C-ordered buffer is stored in fixed-size chunks, in Redis or, above
+    `storage_threshold` bytes, in object storage; pickling only transfers
+    a handle.  Row ranges are fetched into local numpy buffers touching
+    only the chunks they span, and written back chunk by chunk.
+
+    Chunks in object storage are not collected automatically, call
+    `unlink()` once the array is no longer needed.
+    '''
+
+    def __init__(self, array_or_shape, dtype=None, *,
+                 chunk_size=NDARRAY_CHUNK_SIZE,
+                 storage_threshold=NDARRAY_STORAGE_THRESHOLD):
+        if np is None:
+            raise ImportError('SharedNDArray requires numpy')
+
+        if isinstance(array_or_shape, int):
+            array_or_shape = (array_or_shape,)
+        if isinstance(array_or_shape, tuple):
+            data = None
+            shape = array_or_shape
+            dtype = np.dtype(dtype or 'float64')
+        else:
+            data = np.ascontiguousarray(array_or_shape, dtype=dtype)
+            shape = data.shape
+            dtype = data.dtype
+        if len(shape) == 0:
+            raise ValueError('SharedNDArray needs at least one dimension')
+
+        self._oid = 'ndarray-' + util.get_uuid()
+        self._shape = tuple(int(n) for n in shape)
+        self._dtype = dtype.str
+        self._chunk_size = chunk_size
+        self._nbytes = int(np.prod(self._shape, dtype=np.int64)) * dtype.itemsize
+        self._client = util.get_redis_client()
+
+        if self._nbytes > storage_threshold:
+            from ..cloud_proxy import CloudStorage
+            self._storage = CloudStorage()
+            self._ref = None
+        else:
+            self._storage = None
+            self._ref = util.RemoteReference(
+                [self._oid] + [self._chunk_key(i) for i in range(self._nchunks)],
+                client=self._client)
+
+        if data is not None:
+            self._write_range(0, memoryview(data.reshape(-1)).cast('B'))
+        else:
+            self._zero_fill()
+
+    def __getstate__(self):
+        return (self._oid, self._shape, self._dtype, self._chunk_size,
+                self._nbytes, self._client, self._storage, self._ref)
+
+    def __setstate__(self, state):
+        (self._oid, self._shape, self._dtype, self._chunk_size,
+         self._nbytes, self._client, self._storage, self._ref) = state
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return np.dtype(self._dtype)
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return self._nbytes // np.dtype(self._dtype).itemsize
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return self._shape[0]
+
+    #
+    # Chunk transfers
+    #
+
+    @property
+    def _nchunks(self):
+        return -(-self._nbytes // self._chunk_size)
+
+    def _chunk_key(self, i):
+        return '{}-{}'.format(self._oid, i)
+
+    def _chunk_lock_name(self, i):
+        return '{}-lock-{}'.format(self._oid, i)
+
+    def _chunk_lock(self, i):
+        return synchronize.RLock(name=self._chunk_lock_name(i),
+                                 client=self._client)
+
+    def _segments(self, lo, hi):
+        # (chunk, start in chunk, end in chunk, offset from lo)
+        # for every chunk overlapping the byte range [lo, hi)
+        cs = self._chunk_size
+        for i in range(lo // cs, -(-hi // cs)):
+            start = max(lo, i * cs)
+            end = min(hi, (i + 1) * cs)
+            yield i, start - i * cs, end - i * cs, start - lo
+
+    def _map_storage(self, func, items):
+        with ThreadPoolExecutor(NDARRAY_STORAGE_WORKERS) as pool:
+            return list(pool.map(func, items))
+
+    def _zero_fill(self):
+        cs = self._chunk_size
+        if self._storage is None:
+            pipeline = self._client.pipeline(transaction=False)
+            for i in range(self._nchunks):
+                size = min(cs, self._nbytes - i * cs)
+                # redis pads the string with zeros up to the offset
+                pipeline.setrange(self._chunk_key(i), size - 1, b'\0')
+            pipeline.execute()
+        else:
+            def put(i):
+                size = min(cs, self._nbytes - i * cs)
+                self._storage.put_object(self._storage.bucket,
+                                         self._chunk_key(i), bytes(size))
+            self._map_storage(put, range(self._nchunks))
+
+    def _read_range(self, lo, hi):
+        buf = bytearray(hi - lo)
+        view = memoryview(buf)
+        segments = list(self._segments(lo, hi))
+
+        if self._storage is None:
+            pipeline = self._client.pipeline(transaction=False)
+            for i, start, end, _ in segments:
+                pipeline.getrange(self._chunk_key(i), start, end - 1)
+            pieces = pipeline.execute()
+        else:
+            def get(segment):
+                i, start, end, _ = segment
+                return self._storage.get_object(
+                    self._storage.bucket, self._chunk_key(i),
+                    extra_get_args={'Range': 'bytes={}-{}'.format(start, end - 1)})
+            pieces = self._map_storage(get, segments)
+
+        for (_, start, end, offset), piece in zip(segments, pieces):
+            view[offset:offset + end - start] = piece
+        return buf
+
+    def _write_range(self, lo, data, previous=None):
+        # with `previous`, only the chunks that changed are written
+        segments = []
+        for segment in self._segments(lo, lo + len(data)):
+            i, start, end, offset = segment
+            piece = data[offset:offset + end - start]
+            if previous is None or \
+                    piece != previous[offset:offset + end - start]:
+                segments.append((segment, piece))
+        if not segments:
+            return
+
+        if self._storage is None:
+            pipeline = self._client.pipeline(transaction=False)
+            for (i, start, _, _), piece in segments:
+                pipeline.setrange(self._chunk_key(i), start, bytes(piece))
+            pipeline.execute()
+        else:
+            # objects can only be replaced as a whole, so writes to a
+            # chunk are serialised, otherwise the read-modify-write of
+            # one writer could undo the rows written by another
+            def put(item):
+                (i, start, end, _), piece = item
+                size = min(self._chunk_size, self._nbytes - i * self._chunk_size)
+                with self._chunk_lock(i):
+                    if end - start < size:
+                        chunk = bytearray(self._storage.get_object(
+                            self._storage.bucket, self._chunk_key(i)))
+                        chunk[start:end] = piece
+                        piece = chunk
+                    self._storage.put_object(self._storage.bucket,
+                                             self._chunk_key(i), bytes(piece))
+            self._map_storage(put, segments)
+
+    #
+    # Row access
+    #
+
+    def _row_bytes(self):
+        return self._nbytes // self._shape[0]
+
+    def _rows(self, start, stop):
+        if stop is None:
+            stop = self._shape[0]
+        start, stop, _ = slice(start, stop).indices(self._shape[0])
+        return start, max(start, stop)
+
+    def read(self, start=0, stop=None):
+        '''
+        Fetch rows [start, stop) into a local numpy array
+        '''
+        start, stop = self._rows(start, stop)
+        row_bytes = self._row_bytes()
+        buf = self._read_range(start * row_bytes, stop * row_bytes)
+        return np.frombuffer(buf, dtype=self._dtype).reshape(
+            (stop - start,) + self._shape[1:])
+
+    def write(self, start, values):
+        '''
+        Write values to the rows starting at start
+        '''
+        values = np.ascontiguousarray(values, dtype=self._dtype)
+        values = values.reshape((-1,) + self._shape[1:])
+        start, stop = self._rows(start, start + len(values))
+        if stop - start != len(values):
+            raise ValueError('rows out of range')
+        self._write_range(start * self._row_bytes(),
+                          memoryview(values.reshape(-1)).cast('B'))
+
+    @contextlib.contextmanager
+    def map(self, start=0, stop=None):
+        '''
+        Map rows [start, stop) to a local numpy array, the chunks
+        modified are written back when leaving the context
+        '''
+        start, stop = self._rows(start, stop)
+        block = self.read(start, stop)
+        previous = bytes(memoryview(block.reshape(-1)).cast('B'))
+        yield block
+        self._write_range(start * self._row_bytes(),
+                          memoryview(block.reshape(-1)).cast('B'),
+                          previous)
+
+    def _split_key(self, key):
+        # rows to fetch for a key and the key to apply to them
+        if not isinstance(key, tuple):
+            key = (key,)
+        if not key:
+            return 0, self._shape[0], key
+        first, rest = key[0], key[1:]
+
+        if isinstance(first, slice):
+            rows = range(*first.indices(self._shape[0]))
+            if not rows:
+                return 0, 0, (slice(0, 0),) + rest
+            lo, hi = min(rows[0], rows[-1]), max(rows[0], rows[-1]) + 1
+            stop = rows[-1] - lo + (1 if rows.step > 0 else -1)
+            local = slice(rows[0] - lo, stop if stop >= 0 else None, rows.step)
+            return lo, hi, (local,) + rest
+
+        if isinstance(first, int) or hasattr(first, '__index__'):
+            idx = first.__index__()
+            if idx < 0:
+                idx += self._shape[0]
+            if not 0 <= idx < self._shape[0]:
+                raise IndexError('index {} is out of bounds for axis 0 '
+                                 'with size {}'.format(first, self._shape[0]))
+            return idx, idx + 1, (0,) + rest
+
+        # fancy indexing on the first axis, fetch everything
+        return 0, self._shape[0], key
+
+    def __getitem__(self, key):
+        lo, hi, local = self._split_key(key)
+        return self.read(lo, hi)[local]
+
+    def __setitem__(self, key, value):
+        lo, hi, local = self._split_key(key)
+        with self.map(lo, hi) as block:
+            block[local] = value
+
+    def to_numpy(self):
+        return self.read()
+
+    def __array__(self, dtype=None):
+        data = self.read()
+        return data if dtype is None else data.astype(dtype)
+
+    def unlink(self):
+        '''
+        Delete the stored chunks
+        '''
+        if self._storage is None:
+            self._ref.collect()
+        else:
+            keys = [self._chunk_key(i) for i in range(self._nchunks)]
+            self._storage.delete_objects(self._storage.bucket, keys)
+            self._client.delete(*[key for i in range(self._nchunks)
+                                  for key in synchronize.RLock._keys_of(
+                                      self._chunk_lock_name(i))])
+
+    def __repr__(self):
+        return '<%s shape=%r, dtype=%s, key=%r>' % (
+            type(self).__name__, self._shape, np.dtype(self._dtype), self._oid)
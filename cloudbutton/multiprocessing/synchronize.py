@@ -10,9 +10,12 @@
 
 __all__ = [
     'Lock', 'RLock', 'Semaphore', 'BoundedSemaphore',
-    'Condition', 'Event', 'Barrier'
+    'Condition', 'Event', 'Barrier', 'RWLock'
     ]
 
+import contextlib
+import os
+import socket
 import threading
 import time
 
@@ -24,6 +27,20 @@ from . import util
 
 SEM_VALUE_MAX = 2**30
 
+# Fraction of the lease after which the holder renews it
+LEASE_RENEW_RATIO = 1 / 3
+
+# Distinguishes processes with the same pid on different hosts
+_PROCESS_TOKEN = util.get_uuid()
+
+# Longest single wait of a blocked acquire before retrying,
+# bounds the delay caused by a lost or stolen wake-up
+WAKEUP_SLICE = 1.0
+
+def _owner_id():
+    return '{}:{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                threading.get_ident(), _PROCESS_TOKEN)
+
 #
 # Base class for semaphores and mutexes
 #
@@ -31,38 +48,104 @@ SEM_VALUE_MAX = 2**30
 class SemLock:
 
     # KEYS[1] - semlock name
+    # KEYS[2] - acquire_many waiters counter
+    # KEYS[3] - acquire_many wake-up list
     # ARGV[1] - max value
+    # ARGV[2] - number of releases
     # return new semlock value
     # only increments its value if
     # it is not above the max value
     LUA_RELEASE_SCRIPT = """
         local current_value = tonumber(redis.call('llen', KEYS[1]))
-        if current_value >= tonumber(ARGV[1]) then
+        local n = math.min(tonumber(ARGV[2]),
+                           tonumber(ARGV[1]) - current_value)
+        if n <= 0 then
             return current_value
         end
-        redis.call('rpush', KEYS[1], '')
-        return current_value + 1
+        for i=1,n do
+            redis.call('rpush', KEYS[1], '')
+        end
+        local waiters = tonumber(redis.call('get', KEYS[2])) or 0
+        if waiters > 0 then
+            redis.call('del', KEYS[2])
+            for i=1,waiters do
+                redis.call('rpush', KEYS[3], '')
+            end
+        end
+        return current_value + n
     """
 
-    def __init__(self, value=1, max_value=1):
-        self._name = 'semlock-' + util.get_uuid()
+    # KEYS[1] - semlock name
+    # KEYS[2] - (optional) acquire_many waiters counter
+    # ARGV[1] - number of acquisitions
+    # ARGV[2] - 1 if already counted as a waiter
+    # ARGV[3] - 1 to stop being counted as a waiter (timeout)
+    # return 1 if all of them could be
+    # taken at once, 0 otherwise (and
+    # registers as a waiter if KEYS[2])
+    LUA_ACQUIRE_MANY_SCRIPT = """
+        local function unregister()
+            local waiters = tonumber(redis.call('get', KEYS[2])) or 0
+            if waiters > 1 then
+                redis.call('decr', KEYS[2])
+            elseif waiters == 1 then
+                redis.call('del', KEYS[2])
+            end
+        end
+
+        if ARGV[3] == '1' then
+            unregister()
+            return 0
+        end
+        local n = tonumber(ARGV[1])
+        if tonumber(redis.call('llen', KEYS[1])) < n then
+            if #KEYS > 1 and ARGV[2] ~= '1' then
+                redis.call('incr', KEYS[2])
+            end
+            return 0
+        end
+        if ARGV[2] == '1' then
+            unregister()
+        end
+        redis.call('ltrim', KEYS[1], n, -1)
+        return 1
+    """
+
+    def __init__(self, value=1, max_value=1, *, name=None, client=None):
+        # a named semaphore uses keys owned by someone else, who is
+        # in charge of collecting them
+        self._name = name or 'semlock-' + util.get_uuid()
         self._max_value = max_value
-        self._client = util.get_redis_client()
+        self._client = client or util.get_redis_client()
         if value != 0:
             self._client.rpush(self._name, *([''] * value))
 
         self._lua_release = self._client.register_script(Semaphore.LUA_RELEASE_SCRIPT)
         util.make_stateless_script(self._lua_release)
+        self._lua_acquire_many = self._client.register_script(
+            Semaphore.LUA_ACQUIRE_MANY_SCRIPT)
+        util.make_stateless_script(self._lua_acquire_many)
+
+        self._ref = util.RemoteReference(self._keys(), managed=name is not None,
+                                         client=self._client)
 
-        self._ref = util.RemoteReference(self._name, client=self._client)
+    @staticmethod
+    def _keys_of(name):
+        '''
+        Keys used by the semaphore with the given name
+        '''
+        return [name, name + '-waiters', name + '-wake']
+
+    def _keys(self):
+        return self._keys_of(self._name)
 
     def __getstate__(self):
         return (self._name, self._max_value, self._client,
-            self._lua_release, self._ref)
+            self._lua_release, self._lua_acquire_many, self._ref)
 
     def __setstate__(self, state):
         (self._name, self._max_value, self._client,
-            self._lua_release, self._ref) = state
+            self._lua_release, self._lua_acquire_many, self._ref) = state
 
     def __enter__(self):
         self.acquire()
@@ -75,18 +158,42 @@ class SemLock:
         value = self._client.llen(self._name)
         return int(value)
 
-    def acquire(self, block=True):
-        if block:
-            self._client.blpop([self._name])
-            return True
+    def acquire(self, block=True, timeout=None):
+        if block and (timeout is None or timeout > 0):
+            return self._client.blpop([self._name],
+                                      util._block_timeout(timeout)) is not None
         else:
             return self._client.lpop(self._name) is not None
-        
-    def release(self):
-        self._lua_release(keys=[self._name],
-                          args=[self._max_value],
+
+    def _try_acquire_many(self, n):
+        # take n units at once without blocking
+        return bool(self._lua_acquire_many(keys=[self._name],
+                                           args=[n],
+                                           client=self._client))
+
+    def release(self, n=1):
+        self._lua_release(keys=[self._name, self._name + '-waiters',
+                                self._name + '-wake'],
+                          args=[self._max_value, n],
                           client=self._client)
 
+    #
+    # Used by Condition to release the lock from its own script
+    #
+
+    def _release_lua(self):
+        return SemLock.LUA_RELEASE_SCRIPT
+
+    def _release_keys_args(self):
+        return ([self._name, self._name + '-waiters', self._name + '-wake'],
+                [self._max_value, 1])
+
+    def _release_save(self):
+        pass
+
+    def _acquire_restore(self, state):
+        self.acquire()
+
     def __repr__(self):
         try:
             value = self.get_value()
@@ -103,6 +210,41 @@ class Semaphore(SemLock):
     def __init__(self, value=1):
         super().__init__(value, SEM_VALUE_MAX)
 
+    def acquire_many(self, n, block=True, timeout=None):
+        '''
+        Acquire n units of the semaphore at once, atomically.
+        '''
+        if n <= 0:
+            return True
+        if not block:
+            return self._try_acquire_many(n)
+
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        keys = [self._name, self._name + '-waiters']
+        wake_handle = self._name + '-wake'
+        registered = 0
+        while True:
+            # a failed attempt registers us to be woken by the next
+            # release, the registration is kept until that release
+            if self._lua_acquire_many(keys=keys, args=[n, registered],
+                                      client=self._client):
+                return True
+            registered = 1
+
+            waittime = WAKEUP_SLICE
+            if timeout is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._lua_acquire_many(keys=keys, args=[n, registered, 1],
+                                           client=self._client)
+                    return False
+                waittime = min(waittime, remaining)
+            if self._client.blpop([wake_handle],
+                                  util._block_timeout(waittime)) is not None:
+                # the release that woke us cleared the waiters
+                registered = 0
+
 #
 # Bounded semaphore
 #
@@ -118,33 +260,592 @@ class BoundedSemaphore(SemLock):
 #
 
 class Lock(SemLock):
+    '''
+    Non-recursive lock.
+
+    If `lease` (seconds) is given the lock is held as a lease: the owner
+    identity and acquisition time are stored with an expiry that the
+    holder keeps renewing in the background.  If the holder dies, the
+    lease expires and the lock can be taken again by another process.
+    '''
+
+    # KEYS[1] - lease hash
+    # KEYS[2] - wake-up list
+    # ARGV[1] - owner token
+    # ARGV[2] - acquisition time
+    # ARGV[3] - lease duration (ms)
+    # return 0 if the lease was taken, otherwise
+    # the milliseconds left on the current lease
+    LUA_LEASE_ACQUIRE_SCRIPT = """
+        if redis.call('exists', KEYS[1]) == 1 then
+            return math.max(tonumber(redis.call('pttl', KEYS[1])), 1)
+        end
+        redis.call('hset', KEYS[1], 'owner', ARGV[1], 'since', ARGV[2])
+        redis.call('pexpire', KEYS[1], ARGV[3])
+        redis.call('del', KEYS[2])
+        return 0
+    """
 
-    def __init__(self):
-        super().__init__(1, 1)
+    # KEYS[1] - lease hash
+    # ARGV[1] - owner token
+    # ARGV[2] - lease duration (ms)
+    # return 1 if the lease is still held
+    # by the owner and was extended
+    LUA_LEASE_RENEW_SCRIPT = """
+        if redis.call('hget', KEYS[1], 'owner') ~= ARGV[1] then
+            return 0
+        end
+        redis.call('pexpire', KEYS[1], ARGV[2])
+        return 1
+    """
+
+    # KEYS[1] - lease hash
+    # KEYS[2] - wake-up list
+    # ARGV[1] - owner token
+    # return 0 if the lease was released, -1 if
+    # it was not held by the owner anymore
+    LUA_LEASE_RELEASE_SCRIPT = """
+        if redis.call('hget', KEYS[1], 'owner') ~= ARGV[1] then
+            return -1
+        end
+        redis.call('del', KEYS[1], KEYS[2])
+        redis.call('rpush', KEYS[2], '')
+        return 0
+    """
+
+    def __init__(self, lease=None):
+        self._lease = lease
+        super().__init__(1 if lease is None else 0, 1)
         self.owned = False
+        self._token = None
+        self._renewer = None
+
+        if lease is None:
+            self._lease_handle = None
+            self._lua_lease_acquire = None
+            self._lua_lease_renew = None
+            self._lua_lease_release = None
+        else:
+            self._lease_handle = self._name + '-lease'
+            self._lua_lease_acquire = self._client.register_script(
+                Lock.LUA_LEASE_ACQUIRE_SCRIPT)
+            util.make_stateless_script(self._lua_lease_acquire)
+            self._lua_lease_renew = self._client.register_script(
+                Lock.LUA_LEASE_RENEW_SCRIPT)
+            util.make_stateless_script(self._lua_lease_renew)
+            self._lua_lease_release = self._client.register_script(
+                Lock.LUA_LEASE_RELEASE_SCRIPT)
+            util.make_stateless_script(self._lua_lease_release)
+
+    def _keys(self):
+        if self._lease is None:
+            return super()._keys()
+        return super()._keys() + [self._name + '-lease']
+
+    def __getstate__(self):
+        return super().__getstate__() + (self._lease, self._lease_handle,
+            self._lua_lease_acquire, self._lua_lease_renew,
+            self._lua_lease_release)
 
     def __setstate__(self, state):
-        super().__setstate__(state)
+        super().__setstate__(state[:-5])
+        (self._lease, self._lease_handle, self._lua_lease_acquire,
+            self._lua_lease_renew, self._lua_lease_release) = state[-5:]
         self.owned = False
+        self._token = None
+        self._renewer = None
 
-    def acquire(self, block=True):
-        res = super().acquire(block)
-        self.owned = True
+    def acquire(self, block=True, timeout=None):
+        if self._lease is None:
+            res = super().acquire(block, timeout)
+        else:
+            res = self._acquire_lease(block, timeout)
+        if res:
+            self.owned = True
         return res
 
     def release(self):
-        super().release()
+        if self._lease is None:
+            super().release()
+        else:
+            self._release_lease()
+        self.owned = False
+
+    def get_value(self):
+        if self._lease is None:
+            return super().get_value()
+        return 0 if self._client.exists(self._lease_handle) else 1
+
+    def _release_lua(self):
+        if self._lease is None:
+            return super()._release_lua()
+        return Lock.LUA_LEASE_RELEASE_SCRIPT
+
+    def _release_keys_args(self):
+        if self._lease is None:
+            return super()._release_keys_args()
+        return [self._lease_handle, self._name], [self._token]
+
+    def _release_save(self):
+        self._stop_renewal()
+        self._token = None
         self.owned = False
 
+    def _acquire_restore(self, state):
+        self.acquire()
+
+    def get_owner(self):
+        '''
+        Return an (owner, since) tuple describing the current
+        lease holder, or None if the lock is free.
+        '''
+        if self._lease is None:
+            return None
+        owner, since = self._client.hmget(self._lease_handle,
+                                          'owner', 'since')
+        if owner is None:
+            return None
+        return owner.decode('utf-8'), float(since)
+
+    def _acquire_lease(self, block, timeout):
+        # the owner id used by RLock and Condition, made unique per
+        # acquisition so that a holder whose lease expired cannot
+        # release the lease of the next one
+        token = '{}:{}'.format(_owner_id(), util.get_uuid())
+        lease_ms = int(self._lease * 1000)
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            remaining = self._lua_lease_acquire(
+                keys=[self._lease_handle, self._name],
+                args=[token, time.time(), lease_ms],
+                client=self._client)
+            if remaining == 0:
+                break
+            if not block:
+                return False
+            # wait to be woken up by a release, or until the
+            # current lease is due to expire if its holder is gone
+            waittime = remaining / 1000
+            if timeout is not None:
+                waittime = min(waittime, deadline - time.monotonic())
+                if waittime <= 0:
+                    return False
+            self._client.blpop([self._name], util._block_timeout(waittime))
+
+        self._token = token
+        self._start_renewal()
+        return True
+
+    def _release_lease(self):
+        self._stop_renewal()
+        token, self._token = self._token, None
+        if token is None or self._lua_lease_release(
+                keys=[self._lease_handle, self._name],
+                args=[token],
+                client=self._client) < 0:
+            raise RuntimeError('cannot release un-acquired lock '
+                               'or lock lease expired')
+
+    def _start_renewal(self):
+        stop = threading.Event()
+        interval = self._lease * LEASE_RENEW_RATIO
+        lease_ms = int(self._lease * 1000)
+        args = (self._lua_lease_renew, self._lease_handle,
+                self._token, self._client)
+
+        def renew(lua_renew, lease_handle, token, client):
+            while not stop.wait(interval):
+                try:
+                    renewed = lua_renew(keys=[lease_handle],
+                                        args=[token, lease_ms],
+                                        client=client)
+                except Exception as e:
+                    util.debug('lock lease %s renewal failed: %s',
+                               lease_handle, e)
+                    renewed = False
+                if not renewed:
+                    util.debug('lock lease %s lost', lease_handle)
+                    return
+
+        thread = threading.Thread(target=renew, args=args, daemon=True)
+        thread.start()
+        self._renewer = stop
+
+    def _stop_renewal(self):
+        if self._renewer is not None:
+            self._renewer.set()
+            self._renewer = None
+
+    def __repr__(self):
+        if self._lease is None:
+            return super().__repr__()
+        try:
+            owner = self.get_owner()
+        except Exception:
+            owner = 'unknown'
+        if owner is None:
+            return '<%s(unlocked)>' % self.__class__.__name__
+        if isinstance(owner, tuple):
+            owner = '%s, since=%s' % (owner[0], time.ctime(owner[1]))
+        return '<%s(owner=%s)>' % (self.__class__.__name__, owner)
+
 #
 # Recursive lock
 #
 
-class RLock(Lock):
+class RLock(SemLock):
+    '''
+    Recursive lock.
+
+    The owner and recursion depth are kept in a hash.  Nested
+    acquisitions through the same object are counted locally and
+    do not reach the server.
+    '''
+
+    # KEYS[1] - owner hash
+    # KEYS[2] - wake-up list
+    # ARGV[1] - owner id
+    # return new depth, or 0 if owned by someone else
+    LUA_ACQUIRE_SCRIPT = """
+        local owner = redis.call('hget', KEYS[1], 'owner')
+        if owner and owner ~= ARGV[1] then
+            return 0
+        end
+        if not owner then
+            redis.call('hset', KEYS[1], 'owner', ARGV[1])
+            redis.call('del', KEYS[2])
+        end
+        return redis.call('hincrby', KEYS[1], 'count', 1)
+    """
+
+    # KEYS[1] - owner hash
+    # KEYS[2] - wake-up list
+    # ARGV[1] - owner id
+    # ARGV[2] - (optional) 1 to release all levels at once
+    # return new depth, or -1 if not owned by the caller
+    LUA_RELEASE_SCRIPT = """
+        if redis.call('hget', KEYS[1], 'owner') ~= ARGV[1] then
+            return -1
+        end
+        local count = 0
+        if ARGV[2] ~= '1' then
+            count = redis.call('hincrby', KEYS[1], 'count', -1)
+        end
+        if count <= 0 then
+            redis.call('del', KEYS[1], KEYS[2])
+            redis.call('rpush', KEYS[2], '')
+            return 0
+        end
+        return count
+    """
+
+    def __init__(self, *, name=None, client=None):
+        super().__init__(0, 1, name=name, client=client)
+        self._owner_handle = self._name + '-owner'
+        self._lua_racquire = self._client.register_script(
+            RLock.LUA_ACQUIRE_SCRIPT)
+        util.make_stateless_script(self._lua_racquire)
+        self._lua_rrelease = self._client.register_script(
+            RLock.LUA_RELEASE_SCRIPT)
+        util.make_stateless_script(self._lua_rrelease)
+        self._local = threading.local()
+
+    @staticmethod
+    def _keys_of(name):
+        return SemLock._keys_of(name) + [name + '-owner']
+
+    def __getstate__(self):
+        return super().__getstate__() + (self._owner_handle,
+            self._lua_racquire, self._lua_rrelease)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-3])
+        (self._owner_handle, self._lua_racquire,
+            self._lua_rrelease) = state[-3:]
+        self._local = threading.local()
+
+    @property
+    def owned(self):
+        return getattr(self._local, 'depth', 0) > 0
+
+    def acquire(self, block=True, timeout=None):
+        depth = getattr(self._local, 'depth', 0)
+        if depth > 0:
+            self._local.depth = depth + 1
+            return True
+
+        owner = _owner_id()
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while not self._lua_racquire(keys=[self._owner_handle, self._name],
+                                     args=[owner],
+                                     client=self._client):
+            if not block:
+                return False
+            waittime = None
+            if timeout is not None:
+                waittime = deadline - time.monotonic()
+                if waittime <= 0:
+                    return False
+            self._client.blpop([self._name], util._block_timeout(waittime))
+
+        self._local.depth = 1
+        return True
+
+    def release(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            raise RuntimeError('cannot release un-acquired lock')
+        if depth > 1:
+            self._local.depth = depth - 1
+            return
+
+        res = self._lua_rrelease(keys=[self._owner_handle, self._name],
+                                 args=[_owner_id()],
+                                 client=self._client)
+        self._local.depth = 0
+        if res < 0:
+            raise RuntimeError('cannot release un-acquired lock')
+
+    def get_value(self):
+        return 0 if self._client.exists(self._owner_handle) else 1
+
+    def _release_lua(self):
+        return RLock.LUA_RELEASE_SCRIPT
+
+    def _release_keys_args(self):
+        return [self._owner_handle, self._name], [_owner_id(), 1]
+
+    def _release_save(self):
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = 0
+        return depth
+
+    def _acquire_restore(self, depth):
+        self.acquire()
+        self._local.depth = depth
+
+    def __repr__(self):
+        try:
+            owner, count = self._client.hmget(self._owner_handle,
+                                              'owner', 'count')
+            if owner is None:
+                owner, count = 'None', 0
+            else:
+                owner, count = owner.decode('utf-8'), int(count)
+        except Exception:
+            owner, count = 'unknown', 'unknown'
+        return '<%s(%s, %s)>' % (self.__class__.__name__, owner, count)
+
+#
+# Read/write lock
+#
+
+class RWLock:
+    '''
+    Many-readers/one-writer lock.
+
+    Writers are preferred: once a writer is waiting, new readers
+    wait until it has gone through.
+    '''
+
+    # KEYS[1] - state hash
+    # ARGV[1] - 1 to register as a waiter on failure
+    # ARGV[2] - 1 if already registered as a waiting reader
+    # return 1 if a read lock was taken, 0 otherwise
+    LUA_ACQUIRE_READ_SCRIPT = """
+        if redis.call('hexists', KEYS[1], 'writer') == 1 or
+           (tonumber(redis.call('hget', KEYS[1], 'writers_waiting')) or 0) > 0 then
+            if ARGV[1] == '1' and ARGV[2] ~= '1' then
+                redis.call('hincrby', KEYS[1], 'readers_waiting', 1)
+            end
+            return 0
+        end
+        if ARGV[2] == '1' and
+           (tonumber(redis.call('hget', KEYS[1], 'readers_waiting')) or 0) > 0 then
+            redis.call('hincrby', KEYS[1], 'readers_waiting', -1)
+        end
+        redis.call('hincrby', KEYS[1], 'readers', 1)
+        return 1
+    """
 
-    def acquire(self, block=True):
-        return self.owned or super().acquire(block)
+    # KEYS[1] - state hash
+    # ARGV[1] - owner id
+    # ARGV[2] - 1 if already counted as a waiting writer
+    # ARGV[3] - 1 to count as a waiting writer on failure
+    # return 1 if the write lock was taken, 0 otherwise
+    LUA_ACQUIRE_WRITE_SCRIPT = """
+        if redis.call('hexists', KEYS[1], 'writer') == 1 or
+           (tonumber(redis.call('hget', KEYS[1], 'readers')) or 0) > 0 then
+            if ARGV[2] ~= '1' and ARGV[3] == '1' then
+                redis.call('hincrby', KEYS[1], 'writers_waiting', 1)
+            end
+            return 0
+        end
+        if ARGV[2] == '1' then
+            redis.call('hincrby', KEYS[1], 'writers_waiting', -1)
+        end
+        redis.call('hset', KEYS[1], 'writer', ARGV[1])
+        return 1
+    """
 
+    # KEYS[1] - state hash
+    # KEYS[2] - readers wake-up list
+    # KEYS[3] - writers wake-up list
+    # ARGV[1] - 'read', 'write', 'cancel' (a waiting writer gives up)
+    #           or 'cancel_read' (a waiting reader gives up)
+    # ARGV[2] - owner id, for 'write'
+    # return -1 if the caller did not hold the lock
+    LUA_RELEASE_SCRIPT = """
+        if ARGV[1] == 'cancel_read' then
+            local waiting = tonumber(redis.call('hget', KEYS[1], 'readers_waiting')) or 0
+            if waiting > 0 then
+                redis.call('hincrby', KEYS[1], 'readers_waiting', -1)
+            end
+            return 0
+        end
+
+        if ARGV[1] == 'read' then
+            local readers = tonumber(redis.call('hget', KEYS[1], 'readers')) or 0
+            if readers <= 0 then
+                return -1
+            end
+            redis.call('hincrby', KEYS[1], 'readers', -1)
+        elseif ARGV[1] == 'write' then
+            if redis.call('hget', KEYS[1], 'writer') ~= ARGV[2] then
+                return -1
+            end
+            redis.call('hdel', KEYS[1], 'writer')
+        else
+            redis.call('hincrby', KEYS[1], 'writers_waiting', -1)
+        end
+
+        if redis.call('hexists', KEYS[1], 'writer') == 1 then
+            return 0
+        end
+        local readers = tonumber(redis.call('hget', KEYS[1], 'readers')) or 0
+        local writers = tonumber(redis.call('hget', KEYS[1], 'writers_waiting')) or 0
+        if writers > 0 then
+            if readers == 0 then
+                redis.call('rpush', KEYS[3], '')
+            end
+            return 0
+        end
+        local waiting = tonumber(redis.call('hget', KEYS[1], 'readers_waiting')) or 0
+        if waiting > 0 then
+            redis.call('hset', KEYS[1], 'readers_waiting', 0)
+            for i=1,waiting do
+                redis.call('rpush', KEYS[2], '')
+            end
+        end
+        return 0
+    """
+
+    def __init__(self):
+        self._client = util.get_redis_client()
+        self._handle = 'rwlock-' + util.get_uuid()
+        self._read_wake_handle = self._handle + '-read'
+        self._write_wake_handle = self._handle + '-write'
+        self._ref = util.RemoteReference(
+            referenced=[self._handle, self._read_wake_handle,
+                        self._write_wake_handle],
+            client=self._client)
+        self._lua_acquire_read = self._client.register_script(
+            RWLock.LUA_ACQUIRE_READ_SCRIPT)
+        util.make_stateless_script(self._lua_acquire_read)
+        self._lua_acquire_write = self._client.register_script(
+            RWLock.LUA_ACQUIRE_WRITE_SCRIPT)
+        util.make_stateless_script(self._lua_acquire_write)
+        self._lua_release = self._client.register_script(
+            RWLock.LUA_RELEASE_SCRIPT)
+        util.make_stateless_script(self._lua_release)
+
+    def _wait(self, wake_handle, deadline):
+        # None once the deadline has passed, otherwise
+        # whether a wake-up token was received
+        waittime = WAKEUP_SLICE
+        if deadline is not None:
+            waittime = min(waittime, deadline - time.monotonic())
+            if waittime <= 0:
+                return None
+        return self._client.blpop([wake_handle],
+                                  util._block_timeout(waittime)) is not None
+
+    def _release(self, mode, owner=''):
+        res = self._lua_release(keys=[self._handle, self._read_wake_handle,
+                                      self._write_wake_handle],
+                                args=[mode, owner],
+                                client=self._client)
+        if res < 0:
+            raise RuntimeError('cannot release un-acquired lock')
+
+    def acquire_read(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        registered = 0
+        while not self._lua_acquire_read(keys=[self._handle],
+                                         args=[1 if block else 0, registered],
+                                         client=self._client):
+            if not block:
+                return False
+            registered = 1
+            woken = self._wait(self._read_wake_handle, deadline)
+            if woken is None:
+                self._release('cancel_read')
+                return False
+            if woken:
+                # the release that woke us cleared the waiting readers
+                registered = 0
+        return True
+
+    def release_read(self):
+        self._release('read')
+
+    def acquire_write(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        owner = _owner_id()
+        waiting = 0
+        while not self._lua_acquire_write(keys=[self._handle],
+                                          args=[owner, waiting,
+                                                1 if block else 0],
+                                          client=self._client):
+            waiting = 1
+            if not block or self._wait(self._write_wake_handle, deadline) is None:
+                if block:
+                    # stop holding back readers
+                    self._release('cancel')
+                return False
+        return True
+
+    def release_write(self):
+        self._release('write', _owner_id())
+
+    @contextlib.contextmanager
+    def read_lock(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+    def __repr__(self):
+        try:
+            readers, writer = self._client.hmget(self._handle,
+                                                 'readers', 'writer')
+            state = 'readers=%s, writer=%s' % (
+                int(readers or 0),
+                writer.decode('utf-8') if writer else None)
+        except Exception:
+            state = 'unknown'
+        return '<%s(%s)>' % (self.__class__.__name__, state)
 
 #
 # Condition variable
@@ -152,22 +853,64 @@ class RLock(Lock):
 
 class Condition:
 
+    # KEYS[1] - condition waiters list
+    # KEYS[2..] - lock keys
+    # ARGV[1] - waiter handle
+    # ARGV[2..] - lock release arguments
+    # releases the lock and enqueues the waiter handle
+    # return the lock release result, negative on failure
+    LUA_WAIT_SCRIPT = """
+        local function release(KEYS, ARGV)
+            %s
+        end
+        local res = release({unpack(KEYS, 2)}, {unpack(ARGV, 2)})
+        if res >= 0 then
+            redis.call('rpush', KEYS[1], ARGV[1])
+        end
+        return res
+    """
+
+    # KEYS[1] - condition waiters list
+    # ARGV[1] - number of waiters to notify, -1 for all
+    # return number of waiters notified
+    LUA_NOTIFY_SCRIPT = """
+        local n = tonumber(ARGV[1])
+        local handles
+        if n < 0 then
+            handles = redis.call('lrange', KEYS[1], 0, -1)
+            redis.call('del', KEYS[1])
+        else
+            handles = redis.call('lrange', KEYS[1], 0, n - 1)
+            redis.call('ltrim', KEYS[1], n, -1)
+        end
+        for _, handle in ipairs(handles) do
+            redis.call('rpush', handle, '')
+        end
+        return #handles
+    """
+
     def __init__(self, lock=None):
         if lock:
             self._lock = lock
             self._client = util.get_redis_client()
         else:
-            self._lock = Lock()
+            self._lock = RLock()
             # help reducing the amount of open clients
             self._client = self._lock._client
-        
+
         self._notify_handle = 'condition-notify-' + util.get_uuid()
         self._ref = util.RemoteReference(self._notify_handle,
             client=self._client)
 
+        self._lua_wait = self._client.register_script(
+            Condition.LUA_WAIT_SCRIPT % self._lock._release_lua())
+        util.make_stateless_script(self._lua_wait)
+        self._lua_notify = self._client.register_script(
+            Condition.LUA_NOTIFY_SCRIPT)
+        util.make_stateless_script(self._lua_notify)
 
-    def acquire(self):
-        return self._lock.acquire()
+    def acquire(self, block=True, timeout=None):
+        return self._lock.acquire(block, timeout)
 
     def release(self):
         self._lock.release()
@@ -179,51 +922,47 @@ class Condition:
         return self._lock.__exit__(*args)
 
     def wait(self, timeout=None):
-        assert self._lock.owned
-
-        # Enqueue the key we will be waiting for until we are notified
-        self._wait_handle = 'condition-wait-' + util.get_uuid()
-        res = self._client.rpush(self._notify_handle, self._wait_handle)
-
-        if not res:
-            raise Exception('Condition ({}) could not enqueue \
-                waiting key'.format(self._notify_handle))
-
-        # Release lock, wait to get notified, acquire lock
-        self.release()
-        self._client.blpop([self._wait_handle], timeout)
-        self.acquire()
-
-    def notify(self):
-        assert self._lock.owned
-
-        wait_handle = self._client.lpop(self._notify_handle)
-        if wait_handle is not None:
-            res = self._client.rpush(wait_handle, '')
-
-            if not res:
-                raise Exception('Condition ({}) could not notify \
-                    one waiting process'.format(self._notify_handle))
-
-
-    def notify_all(self, msg=''):
-        assert self._lock.owned
-
-        pipeline = self._client.pipeline(transaction=False)
-        pipeline.lrange(self._notify_handle, 0, -1)
-        pipeline.delete(self._notify_handle)
-        wait_handles, _ = pipeline.execute()
-
-        if len(wait_handles) > 0:
-            pipeline = self._client.pipeline(transaction=False)
-            for handle in wait_handles:
-                pipeline.rpush(handle, msg)
-            results = pipeline.execute()
-
-            if not all(results):
-                raise Exception('Condition ({}) could not notify \
-                    all waiting processes'.format(self._notify_handle))
+        assert self._lock.owned, 'cannot wait on un-acquired lock'
+
+        # Enqueue the key we will be notified through and
+        # release the lock, atomically
+        wait_handle = 'condition-wait-' + util.get_uuid()
+        # deletes the wait list, and a wake-up left in it, once this
+        # wait is over, also if it is interrupted
+        wait_ref = util.RemoteReference(wait_handle, client=self._client)
+        keys, args = self._lock._release_keys_args()
+        res = self._lua_wait(keys=[self._notify_handle] + keys,
+                             args=[wait_handle] + args,
+                             client=self._client)
+        if res < 0:
+            raise RuntimeError('Condition ({}) could not release '
+                               'its lock'.format(self._notify_handle))
+        saved_state = self._lock._release_save()
 
+        try:
+            notified = self._client.blpop([wait_handle],
+                                          util._block_timeout(timeout)) is not None
+            if not notified and self._client.lrem(self._notify_handle,
+                                                  1, wait_handle) == 0:
+                # notified while timing out, the wake-up
+                # is deleted along with the wait list
+                notified = True
+            return notified
+        finally:
+            del wait_ref
+            self._lock._acquire_restore(saved_state)
+
+    def notify(self, n=1):
+        assert self._lock.owned, 'cannot notify on un-acquired lock'
+        self._lua_notify(keys=[self._notify_handle],
+                         args=[n],
+                         client=self._client)
+
+    def notify_all(self):
+        assert self._lock.owned, 'cannot notify on un-acquired lock'
+        self._lua_notify(keys=[self._notify_handle],
+                         args=[-1],
+                         client=self._client)
 
     def wait_for(self, predicate, timeout=None):
         result = predicate()
@@ -243,7 +982,13 @@ class Condition:
             result = predicate()
         return result
 
-    # def __repr__(self):
+    def __repr__(self):
+        try:
+            num_waiters = self._client.llen(self._notify_handle)
+        except Exception:
+            num_waiters = 'unknown'
+        return '<%s(%s, %s)>' % (self.__class__.__name__, self._lock,
+                                 num_waiters)
 
 #
 # Event
@@ -251,62 +996,266 @@ class Condition:
 
 class Event:
 
+    # KEYS[1] - event state hash
+    # return -1 if the flag is set, otherwise registers
+    # a waiter and returns the current generation
+    LUA_WAIT_SCRIPT = """
+        if redis.call('hget', KEYS[1], 'flag') == '1' then
+            return -1
+        end
+        redis.call('hincrby', KEYS[1], 'waiters', 1)
+        return tonumber(redis.call('hget', KEYS[1], 'generation')) or 0
+    """
+
+    # KEYS[1] - event state hash
+    # KEYS[2] - wake-up list
+    # sets the flag and wakes up all the registered
+    # waiters with a token of the new generation
+    # return number of waiters woken up
+    LUA_SET_SCRIPT = """
+        if redis.call('hget', KEYS[1], 'flag') == '1' then
+            return 0
+        end
+        local gen = redis.call('hincrby', KEYS[1], 'generation', 1)
+        local waiters = tonumber(redis.call('hget', KEYS[1], 'waiters')) or 0
+        redis.call('hset', KEYS[1], 'flag', '1', 'waiters', 0)
+        for i=1,waiters do
+            redis.call('rpush', KEYS[2], gen)
+        end
+        return waiters
+    """
+
+    # KEYS[1] - event state hash
+    # KEYS[2] - wake-up list
+    # ARGV[1] - generation the waiter registered in
+    # unregisters a waiter that timed out and returns 0, or
+    # returns 1 and takes its token if the flag was set meanwhile
+    LUA_CANCEL_SCRIPT = """
+        local gen = tonumber(redis.call('hget', KEYS[1], 'generation')) or 0
+        if gen > tonumber(ARGV[1]) then
+            redis.call('lpop', KEYS[2])
+            return 1
+        end
+        redis.call('hincrby', KEYS[1], 'waiters', -1)
+        return 0
+    """
+
     def __init__(self):
-        self._cond = Condition()
-        self._client = self._cond._client
-        self._flag_handle = 'event-flag-' + util.get_uuid()
-        self._ref = util.RemoteReference(self._flag_handle,
+        self._client = util.get_redis_client()
+        self._handle = 'event-' + util.get_uuid()
+        self._wake_handle = self._handle + '-wake'
+        self._ref = util.RemoteReference(
+            referenced=[self._handle, self._wake_handle],
             client=self._client)
+        self._lua_wait = self._client.register_script(Event.LUA_WAIT_SCRIPT)
+        util.make_stateless_script(self._lua_wait)
+        self._lua_set = self._client.register_script(Event.LUA_SET_SCRIPT)
+        util.make_stateless_script(self._lua_set)
+        self._lua_cancel = self._client.register_script(Event.LUA_CANCEL_SCRIPT)
+        util.make_stateless_script(self._lua_cancel)
 
     def is_set(self):
-        return self._client.get(self._flag_handle) == b'1'
+        return self._client.hget(self._handle, 'flag') == b'1'
 
     def set(self):
-        with self._cond:
-            self._client.set(self._flag_handle, '1')
-            self._cond.notify_all()
+        self._lua_set(keys=[self._handle, self._wake_handle],
+                      client=self._client)
 
     def clear(self):
-        with self._cond:
-            self._client.set(self._flag_handle, '0')
+        self._client.hset(self._handle, 'flag', '0')
 
     def wait(self, timeout=None):
-        with self._cond:
-            self._cond.wait_for(self.is_set, timeout)
+        gen = self._lua_wait(keys=[self._handle], client=self._client)
+        if gen < 0:
+            return True
+
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            waittime = None
+            if timeout is not None:
+                waittime = deadline - time.monotonic()
+                if waittime <= 0:
+                    return bool(self._lua_cancel(
+                        keys=[self._handle, self._wake_handle],
+                        args=[gen], client=self._client))
+            res = self._client.blpop([self._wake_handle],
+                                     util._block_timeout(waittime))
+            # tokens of older generations were left
+            # behind by waiters that timed out
+            if res is not None and int(res[1]) > gen:
+                return True
+
+    def __repr__(self):
+        try:
+            set_status = 'set' if self.is_set() else 'unset'
+        except Exception:
+            set_status = 'unknown'
+        return '<%s(%s)>' % (self.__class__.__name__, set_status)
 
 #
 # Barrier
 #
 
-class Barrier(threading.Barrier):
+class Barrier:
+    '''
+    Distributed barrier.
+
+    Arrivals are counted by a Lua script; the last party of a
+    generation wakes up all the others with a single push of
+    (parties - 1) tokens to the generation's wake-up list.
+    '''
+
+    # KEYS[1] - barrier state hash
+    # KEYS[2] - wake-up list for even generations
+    # KEYS[3] - wake-up list for odd generations
+    # ARGV[1] - number of parties
+    # return {arrival index, generation},
+    # or {-1, generation} if broken
+    LUA_ARRIVE_SCRIPT = """
+        local gen = tonumber(redis.call('hget', KEYS[1], 'generation')) or 0
+        if redis.call('hget', KEYS[1], 'broken') == '1' then
+            return {-1, gen}
+        end
+        local index = redis.call('hincrby', KEYS[1], 'count', 1) - 1
+        if index + 1 >= tonumber(ARGV[1]) then
+            -- last one in: open the next generation, its wake-up
+            -- list only holds tokens of finished generations
+            redis.call('hset', KEYS[1], 'count', 0, 'generation', gen + 1)
+            redis.call('del', KEYS[2 + (gen + 1) % 2])
+        end
+        return {index, gen}
+    """
+
+    # KEYS[1] - barrier state hash
+    # KEYS[2] - wake-up list for even generations
+    # KEYS[3] - wake-up list for odd generations
+    # ARGV[1] - number of parties
+    # ARGV[2] - 1 to leave the barrier broken, 0 to reset it
+    # ARGV[3] - (optional) generation being broken
+    # wakes up the waiters of the given and the current
+    # generations with a broken token and starts a new one
+    LUA_BREAK_SCRIPT = """
+        local current = tonumber(redis.call('hget', KEYS[1], 'generation')) or 0
+        local gens = {current}
+        local gen = tonumber(ARGV[3])
+        if gen and gen ~= current then
+            gens = {gen, current}
+        end
+        for _, g in ipairs(gens) do
+            for i=1,tonumber(ARGV[1]) do
+                redis.call('rpush', KEYS[2 + g % 2], 'broken:' .. g)
+            end
+        end
+        redis.call('hset', KEYS[1], 'count', 0, 'generation', current + 1,
+                   'broken', ARGV[2])
+        return current + 1
+    """
 
     def __init__(self, parties, action=None, timeout=None):
-        self._cond = Condition()
-        self._client = self._cond._client
-        uuid = util.get_uuid()
-        self._state_handle = 'barrier-state-' + uuid
-        self._count_handle = 'barrier-count-' + uuid
+        self._client = util.get_redis_client()
+        self._handle = 'barrier-' + util.get_uuid()
+        self._wake_handles = [self._handle + '-wake-0',
+                              self._handle + '-wake-1']
         self._ref = util.RemoteReference(
-            referenced=[self._state_handle, self._count_handle],
+            referenced=[self._handle] + self._wake_handles,
             client=self._client)
+        self._lua_arrive = self._client.register_script(
+            Barrier.LUA_ARRIVE_SCRIPT)
+        util.make_stateless_script(self._lua_arrive)
+        self._lua_break = self._client.register_script(
+            Barrier.LUA_BREAK_SCRIPT)
+        util.make_stateless_script(self._lua_break)
         self._action = action
         self._timeout = timeout
         self._parties = parties
-        self._state = 0 #0 filling, 1, draining, -1 resetting, -2 broken
-        self._count = 0
+        self._client.hset(self._handle, mapping={
+            'count': 0, 'generation': 0, 'broken': 0})
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            timeout = self._timeout
+
+        index, gen = self._lua_arrive(keys=[self._handle] + self._wake_handles,
+                                      args=[self._parties],
+                                      client=self._client)
+        if index < 0:
+            raise threading.BrokenBarrierError
+        wake_handle = self._wake_handles[gen % 2]
+
+        if index + 1 == self._parties:
+            # last one in: run the action and release the rest
+            if self._action:
+                try:
+                    self._action()
+                except:
+                    self._break(gen, broken=True)
+                    raise
+            if self._parties > 1:
+                self._client.rpush(wake_handle,
+                                   *(['ok:%d' % gen] * (self._parties - 1)))
+            return index
+
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            waittime = None
+            if timeout is not None:
+                waittime = deadline - time.monotonic()
+                if waittime <= 0:
+                    self._break(gen, broken=True)
+                    raise threading.BrokenBarrierError
+            res = self._client.blpop([wake_handle], util._block_timeout(waittime))
+            if res is None:
+                continue
+            state, _, token_gen = res[1].decode('utf-8').partition(':')
+            if int(token_gen) != gen:
+                # left over from an older generation
+                continue
+            if state == 'broken':
+                raise threading.BrokenBarrierError
+            return index
+
+    def _break(self, gen, broken):
+        args = [self._parties, 1 if broken else 0]
+        if gen is not None:
+            args.append(gen)
+        self._lua_break(keys=[self._handle] + self._wake_handles,
+                        args=args,
+                        client=self._client)
+
+    def reset(self):
+        '''
+        Reset the barrier to the initial state; parties currently
+        waiting get a BrokenBarrierError.
+        '''
+        self._break(None, broken=False)
+
+    def abort(self):
+        '''
+        Place the barrier into a broken state.
+        '''
+        self._break(None, broken=True)
 
     @property
-    def _state(self):
-        return int(self._client.get(self._state_handle))
+    def parties(self):
+        return self._parties
 
-    @_state.setter
-    def _state(self, value):
-        self._client.set(self._state_handle, value)
+    @property
+    def n_waiting(self):
+        count = self._client.hget(self._handle, 'count')
+        return 0 if count is None else int(count)
 
     @property
-    def _count(self):
-        return int(self._client.get(self._count_handle))
+    def broken(self):
+        return self._client.hget(self._handle, 'broken') == b'1'
 
-    @_count.setter
-    def _count(self, value):
-        self._client.set(self._count_handle, value)
+    def __repr__(self):
+        try:
+            if self.broken:
+                return '<%s(broken)>' % self.__class__.__name__
+            waiting = self.n_waiting
+        except Exception:
+            waiting = 'unknown'
+        return '<%s(waiters=%s/%s)>' % (
+            self.__class__.__name__, waiting, self._parties)
@@ -11,6 +11,7 @@
 import os
 import itertools
 import sys
+import time
 import weakref
 import atexit
 import redis
@@ -422,6 +423,158 @@ def spawnv_passfds(path, args, passfds):
         os.close(errpipe_write)
 
 
+#
+# Process-wide registry of redis connection pools
+#
+
+# Seconds a pooled connection may stay unused before being closed
+REDIS_POOL_IDLE_TIMEOUT = 300
+# Seconds a client waits for a free connection of a full pool
+# before failing, None waits for as long as it takes
+REDIS_POOL_TIMEOUT = None
+
+class SharedConnectionPool(redis.ConnectionPool):
+    '''
+    Connection pool shared by every client of this process that
+    connects with the same parameters. With `max_connections` set,
+    clients wait up to `timeout` seconds for a connection to be free.
+    Connections left idle for more than `idle_timeout` seconds are
+    closed when the pool is next used.
+
+    Only the public interface of redis.ConnectionPool is relied on,
+    the bookkeeping of the pool is kept here.
+    '''
+    def __init__(self, idle_timeout=REDIS_POOL_IDLE_TIMEOUT,
+                 max_connections=None, timeout=REDIS_POOL_TIMEOUT, **kwargs):
+        self.idle_timeout = idle_timeout
+        self.limit = max_connections
+        self.timeout = timeout
+        # the slots bound the connections, the base pool never refuses one
+        super().__init__(**kwargs)
+
+    def reset(self):
+        # also called after a fork
+        super().reset()
+        self._stats_lock = threading.Lock()
+        self._slots = None if self.limit is None \
+            else threading.BoundedSemaphore(self.limit)
+        self._created = 0
+        self._in_use = set()
+        self._idle = {}     # released connection -> release time
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with self._stats_lock:
+            self._created += 1
+        return connection
+
+    def get_connection(self, *args, **kwargs):
+        self._evict_idle()
+        if self._slots is not None and \
+                not self._slots.acquire(timeout=self.timeout):
+            raise redis.ConnectionError('No connection available.')
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except BaseException:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        with self._stats_lock:
+            self._idle.pop(connection, None)
+            self._in_use.add(connection)
+        return connection
+
+    def release(self, connection):
+        with self._stats_lock:
+            in_use = connection in self._in_use
+            self._in_use.discard(connection)
+            if in_use:
+                self._idle[connection] = time.monotonic()
+        super().release(connection)
+        # connections taken before a fork hold no slot
+        if in_use and self._slots is not None:
+            self._slots.release()
+
+    def _evict_idle(self):
+        if not self.idle_timeout:
+            return
+        limit = time.monotonic() - self.idle_timeout
+        with self._stats_lock:
+            idle = [c for c, released in self._idle.items() if released < limit]
+            for connection in idle:
+                del self._idle[connection]
+        # the pool reconnects them when they are next used
+        for connection in idle:
+            connection.disconnect()
+
+    def stats(self):
+        '''
+        Return the number of created, in use and idle connections
+        '''
+        with self._stats_lock:
+            return {
+                'created': self._created,
+                'in_use': len(self._in_use),
+                'available': self._created - len(self._in_use),
+                'max_connections': self.limit
+            }
+
+
+_pool_registry = {}
+_pool_registry_lock = threading.Lock()
+
+
+def _pool_key(conn_params):
+    return tuple(sorted((k, repr(v)) for k, v in conn_params.items()))
+
+
+def get_connection_pool(**conn_params):
+    '''
+    Return the pool registered for `conn_params`, creating it if needed.
+    Besides the usual redis client arguments, `max_connections`,
+    `pool_timeout` and `idle_timeout` configure the pool itself.
+    '''
+    key = _pool_key(conn_params)
+    with _pool_registry_lock:
+        pool = _pool_registry.get(key)
+        if pool is None:
+            params = dict(conn_params)
+            idle_timeout = params.pop('idle_timeout', REDIS_POOL_IDLE_TIMEOUT)
+            max_connections = params.pop('max_connections', None)
+            timeout = params.pop('pool_timeout', REDIS_POOL_TIMEOUT)
+            # let redis translate client arguments (ssl, unix sockets...)
+            # into pool arguments; this does not open any connection
+            template = redis.StrictRedis(**params).connection_pool
+            pool = SharedConnectionPool(
+                idle_timeout=idle_timeout,
+                connection_class=template.connection_class,
+                max_connections=max_connections,
+                timeout=timeout,
+                **template.connection_kwargs)
+            _pool_registry[key] = pool
+        return pool
+
+
+def get_pool_stats():
+    '''
+    Return the stats of every connection pool of this process
+    '''
+    with _pool_registry_lock:
+        pools = list(_pool_registry.values())
+    return [pool.stats() for pool in pools]
+
+
+def clear_connection_pools():
+    '''
+    Disconnect and forget every connection pool of this process
+    '''
+    with _pool_registry_lock:
+        pools = list(_pool_registry.values())
+        _pool_registry.clear()
+    for pool in pools:
+        pool.disconnect()
+
+
 #
 # Picklable redis client
 #
@@ -430,12 +583,16 @@ class PicklableRedis(redis.StrictRedis):
     def __init__(self, *args, **kwargs):
         self._args = args
         self._kwargs = kwargs
-        super().__init__(*self._args, **self._kwargs)
+        if args or 'connection_pool' in kwargs:
+            super().__init__(*self._args, **self._kwargs)
+        else:
+            super().__init__(connection_pool=get_connection_pool(**kwargs))
 
     def __getstate__(self):
         return (self._args, self._kwargs)
 
     def __setstate__(self, state):
+        # reuses the pool already registered for these parameters
         self.__init__(*state[0], **state[1])
 
 
@@ -456,6 +613,15 @@ def get_uuid(length=12):
     return uuid.uuid1().hex[:length]
 
 
+#
+# Timeout argument of blocking redis commands, where 0 means
+# "forever": a tiny or rounded down timeout must not block forever
+#
+
+def _block_timeout(timeout):
+    return 0 if timeout is None else max(timeout, 0.01)
+
+
 #
 # Make stateless redis Lua script (redis.client.Script)
 # Just to ensure no redis client is cache'd and avoid 
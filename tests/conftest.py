@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+from lithops.wait import ANY_COMPLETED, ALL_COMPLETED, ALWAYS
+
+from cloudbutton.multiprocessing import util, pool
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+#
+# Redis
+#
+
+class FakePicklableRedis(fakeredis.FakeStrictRedis):
+    server = None
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        super().__init__(server=self.server)
+
+    def __getstate__(self):
+        return (self._args, self._kwargs)
+
+    def __setstate__(self, state):
+        self.__init__(*state[0], **state[1])
+
+
+@pytest.fixture(autouse=True)
+def redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(FakePicklableRedis, 'server', server)
+    monkeypatch.setattr(util, 'PicklableRedis', FakePicklableRedis)
+    monkeypatch.setattr(util, 'default_config', lambda: {'redis': {}})
+    return server
+
+
+#
+# Executor running every call in a local thread
+#
+
+class FakeFuture:
+    def __init__(self, func, args):
+        self.ready = self.done = self.error = False
+        self.running = False
+        # worker timestamps, set like lithops does once the call runs
+        self.stats = {}
+        self._call_status = None
+        self._event = threading.Event()
+        thread = threading.Thread(target=self._run, args=(func, args))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, func, args):
+        start = time.time()
+        self._call_status = {'worker_start_tstamp': start}
+        self.running = True
+        try:
+            self._value = func(*args)
+        except Exception as e:
+            self._value = e
+            self.error = True
+        self.stats = {'worker_start_tstamp': start,
+                      'worker_end_tstamp': time.time()}
+        self.running = False
+        self.ready = self.done = True
+        self._event.set()
+
+    def result(self, throw_except=True, internal_storage=None):
+        self._event.wait()
+        if self.error and throw_except:
+            raise self._value
+        return self._value
+
+
+class FakeExecutor:
+    '''
+    Mimics the parts of lithops.FunctionExecutor used by the pool,
+    including get_result() unwrapping single results unless the last
+    call was a map
+    '''
+
+    def __init__(self, workers=4, **kwargs):
+        self.invoker = type('Invoker', (), {'workers': workers})()
+        self.last_call = None
+        self.jobs = 0
+
+    @staticmethod
+    def _args(data):
+        if isinstance(data, dict):
+            raise NotImplementedError
+        return data if isinstance(data, tuple) else (data, )
+
+    def call_async(self, func, data, **kwargs):
+        self.jobs += 1
+        self.last_call = 'call_async'
+        return FakeFuture(func, tuple(data) if isinstance(data, list)
+                          else self._args(data))
+
+    def map(self, func, iterdata, **kwargs):
+        self.jobs += 1
+        self.last_call = 'map'
+        return [FakeFuture(func, self._args(data)) for data in iterdata]
+
+    def wait(self, fs, throw_except=True, return_when=ALL_COMPLETED,
+             download_results=False, timeout=None, **kwargs):
+        while True:
+            done = [f for f in fs if f.done]
+            if return_when == ALWAYS or len(done) == len(fs) or \
+                    (return_when == ANY_COMPLETED and done):
+                return done, [f for f in fs if not f.done]
+            time.sleep(0.005)
+
+    def get_result(self, fs, **kwargs):
+        self.wait(fs)
+        result = [f.result() for f in fs]
+        if len(result) == 1 and self.last_call != 'map':
+            return result[0]
+        return result
+
+    def clean(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(pool, 'FunctionExecutor', FakeExecutor)
+    return FakeExecutor
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from cloudbutton.multiprocessing import connection
+
+
+def test_wait_tiny_timeout_does_not_block_forever():
+    reader, _ = connection.Pipe(duplex=False)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(
+        connection.wait([(reader._client, reader._subhandle)], 1e-4)))
+    waiter.daemon = True
+    waiter.start()
+    waiter.join(5)
+    assert result == [[]]
+
+
+def test_wait_peek_back_keeps_items_in_order():
+    (reader1, _), (reader2, writer2) = connection.Pipe(False), \
+        connection.Pipe(False)
+    objs = [(reader1._client, reader1._subhandle),
+            (reader2._client, reader2._subhandle)]
+
+    def send():
+        time.sleep(0.2)
+        writer2.send_bytes_many([b'a', b'b'])
+    threading.Thread(target=send).start()
+
+    assert connection.wait(objs, timeout=5) == objs[1:]
+    assert not reader1.poll()
+    assert reader2.recv_bytes() == b'a'
+    assert reader2.recv_bytes() == b'b'
+
+
+def test_wait_reports_every_ready_list():
+    (reader1, writer1), (reader2, writer2) = connection.Pipe(False), \
+        connection.Pipe(False)
+    objs = [(reader1._client, reader1._subhandle),
+            (reader2._client, reader2._subhandle)]
+    client = reader1._client
+    handles = [reader1._subhandle, reader2._subhandle]
+
+    # the item popped by the blocking wait goes back to the head of
+    # its list, and the other list is checked in the same script
+    writer2.send_bytes(b'y')
+    peek_back = client.register_script(connection.LUA_PEEK_BACK_SCRIPT)
+    client.rpush(handles[0], b'z')
+    assert peek_back(keys=handles, args=[b'x']) == [1]
+    assert client.lrange(handles[0], 0, -1) == [b'x', b'z']
+    assert connection.wait(objs, timeout=1) == objs
@@ -0,0 +1,218 @@
+import pickle
+import threading
+
+import pytest
+
+from cloudbutton.multiprocessing import managers
+
+
+class FakeListener:
+    available = True
+
+    def register(self, key, cache):
+        return True
+
+
+@pytest.fixture
+def invalidation_listener(monkeypatch):
+    monkeypatch.setattr(managers, '_get_invalidation_listener',
+                        lambda client: FakeListener())
+
+
+def test_namespace_cache(invalidation_listener):
+    ns = managers.NamespaceProxy(cache=True, x=1)
+    assert ns.x == 1
+    assert ns.x == 1
+    assert ns._cache.stats()['hits'] == 1
+    ns.x = 2
+    assert ns.x == 2
+    ns.cache = 3
+    assert ns.cache == 3
+
+
+def test_namespace_without_cache(invalidation_listener):
+    ns = managers.NamespaceProxy(x=1)
+    assert ns.x == 1
+    assert ns._cache is None
+
+
+class FakeConnection:
+    '''
+    Records the commands of the invalidation listener
+    '''
+    commands = []
+
+    def __init__(self, **kwargs):
+        self._reply = None
+
+    def send_command(self, *args):
+        self.commands.append(args)
+        self._reply = 7 if args == ('CLIENT', 'ID') else b'OK'
+
+    def read_response(self):
+        return self._reply
+
+    def can_read(self, timeout=0):
+        threading.Event().wait()
+
+    def disconnect(self):
+        pass
+
+
+def test_invalidation_listener_tracks_cached_keys(monkeypatch):
+    monkeypatch.setattr(FakeConnection, 'commands', [])
+    pool = type('Pool', (), {'connection_class': FakeConnection,
+                             'connection_kwargs': {}})()
+    listener = managers._InvalidationListener(pool)
+    assert listener.available
+    assert not [c for c in FakeConnection.commands if 'ON' in c]
+
+    caches = [managers.NearCache() for _ in range(3)]
+    assert listener.register('dict-a', caches[0])
+    assert listener.register('dict-a', caches[1])
+    assert listener.register('Namespace-b', caches[2])
+    assert [c for c in FakeConnection.commands if 'ON' in c] == [
+        ('CLIENT', 'TRACKING', 'ON', 'REDIRECT', 7, 'BCAST',
+         'PREFIX', 'dict-a'),
+        ('CLIENT', 'TRACKING', 'ON', 'REDIRECT', 7, 'BCAST',
+         'PREFIX', 'Namespace-b')]
+
+    for cache in caches:
+        cache.store('k', 1, 1, 0)
+    listener._handle([b'message', b'__redis__:invalidate', [b'dict-a']])
+    assert [c.stats()['entries'] for c in caches] == [0, 0, 1]
+    listener._handle([b'subscribe', b'__redis__:invalidate', 1])
+    assert caches[2].stats()['entries'] == 1
+    # flushed database
+    listener._handle([b'message', b'__redis__:invalidate', None])
+    assert caches[2].stats()['entries'] == 0
+
+
+def test_value_lock_is_shared_and_lazy():
+    value = managers.ValueProxy('i', 0)
+    assert value._lock is True
+    copy = pickle.loads(pickle.dumps(value))
+
+    lock = value.get_lock()
+    assert value.get_lock() is lock
+    assert lock.acquire()
+    other = []
+    thread = threading.Thread(
+        target=lambda: other.append(copy.get_lock().acquire(block=False)))
+    thread.start()
+    thread.join()
+    assert other == [False]
+    lock.release()
+    assert copy.get_lock().acquire(block=False)
+    copy.get_lock().release()
+
+    value._ref.collect()
+    assert not value._client.keys(value._oid + '*')
+
+
+def test_raw_value_has_no_lock():
+    value = managers.ValueProxy('i', 0, lock=False)
+    with pytest.raises(AttributeError):
+        value.get_lock()
+
+
+def test_array_lock_is_lazy():
+    arr = managers.ArrayProxy('i', [1, 2, 3])
+    assert arr._lock is True
+    copy = pickle.loads(pickle.dumps(arr))
+    assert copy.get_lock()._name == arr.get_lock()._name
+    assert list(copy) == [1, 2, 3]
+
+
+def test_dict_iteration_skips_duplicate_fields(monkeypatch):
+    d = managers.DictProxy({'a': 1, 'b': 2, 'c': 3})
+    hscan = d._client.hscan
+
+    def rehashing_hscan(name, cursor=0, **kwargs):
+        # the second page returns a field of the first one again
+        if cursor == 0:
+            return 1, {b'a': hscan(name)[1][b'a']}
+        return 0, hscan(name)[1]
+
+    monkeypatch.setattr(d._client, 'hscan', rehashing_hscan)
+    assert sorted(d) == ['a', 'b', 'c']
+    assert sorted(d.iteritems()) == [('a', 1), ('b', 2), ('c', 3)]
+    assert sorted(d.keys()) == ['a', 'b', 'c']
+
+
+def test_value_lock_keys_are_collected():
+    value = managers.ValueProxy('i', 0)
+    with value.get_lock():
+        pass
+    value._ref.collect()
+    assert not value._client.keys('*' + value._oid + '*')
+
+
+def test_integer_value_is_exact_above_2_53():
+    big = 2 ** 60
+    value = managers.ValueProxy('q', big)
+    assert not value.compare_and_swap(big + 1, 0)
+    assert value.compare_and_swap(big, big + 1)
+    assert value.value == big + 1
+    assert value.max(big + 2) == big + 2
+    assert value.max(big) == big + 2
+    assert value.min(-big - 1) == -big - 1
+    assert value.min(-big) == -big - 1
+    assert value.max(-3) == -3
+
+
+def test_float_value_compare_and_swap():
+    value = managers.ValueProxy('d', 1.5)
+    assert value.compare_and_swap(1.5, 2.0)
+    assert value.max(1.0) == 2.0
+    assert value.min(-0.5) == -0.5
+
+
+def test_batch_keeps_the_order_of_operations():
+    lst = managers.ListProxy([1, 2, 3])
+    d = managers.DictProxy(a=1)
+    with lst.batch():
+        lst.append(4)
+        lst.remove(1)
+        item = lst[-1]
+        d['a'] = 2
+        value = d.get('a')
+        d.clear()
+        missing = d.get('a', 'missing')
+    assert item.result() == 4
+    assert value.result() == 2
+    assert missing.result() == 'missing'
+    assert lst.tolist() == [2, 3, 4]
+    assert len(d) == 0
+
+
+@pytest.mark.parametrize('operation', [
+    lambda lst, d, v: len(lst),
+    lambda lst, d, v: lst.pop(0),
+    lambda lst, d, v: lst[0:2],
+    lambda lst, d, v: list(lst),
+    lambda lst, d, v: len(d),
+    lambda lst, d, v: 'a' in d,
+    lambda lst, d, v: d.setdefault('a', 0),
+    lambda lst, d, v: d.pop('a'),
+    lambda lst, d, v: d.keys(),
+    lambda lst, d, v: v.compare_and_swap(0, 1),
+])
+def test_batch_rejects_unbatched_operations(operation):
+    lst = managers.ListProxy([1, 2, 3])
+    d = managers.DictProxy(a=1)
+    v = managers.ValueProxy('i', 0)
+    with pytest.raises(RuntimeError):
+        with lst.batch():
+            lst.append(4)
+            operation(lst, d, v)
+    # the rejected batch was discarded
+    assert lst.tolist() == [1, 2, 3]
+    assert d.todict() == {'a': 1}
+
+
+def test_batch_list_assignment_out_of_range():
+    lst = managers.ListProxy([1])
+    with pytest.raises(IndexError):
+        with lst.batch():
+            lst[5] = 0
@@ -0,0 +1,245 @@
+import threading
+import time
+
+import pytest
+
+from cloudbutton.multiprocessing import pool, TimeoutError
+from cloudbutton.multiprocessing.pool import Pool
+
+
+def square(x):
+    return x * x
+
+
+def test_apply_async_coalesced(executor):
+    with Pool(2, coalesce_window=0.05) as p:
+        results = [p.apply_async(square, (i, )) for i in range(3)]
+        assert [r.get() for r in results] == [0, 1, 4]
+        assert p._executor.jobs == 1
+
+
+def test_apply_async_coalesced_full_batch(executor):
+    with Pool(2, coalesce_window=60, coalesce_max=3) as p:
+        results = [p.apply_async(square, (i, )) for i in range(3)]
+        assert [r.get(timeout=5) for r in results] == [0, 1, 4]
+
+
+def power(base, exp=2):
+    return base ** exp
+
+
+@pytest.mark.parametrize('coalesce_window', [None, 0.01])
+def test_apply_async_binds_kwds(executor, coalesce_window):
+    with Pool(2, coalesce_window=coalesce_window) as p:
+        assert p.apply_async(power, (3, ), {'exp': 3}).get(timeout=5) == 27
+        assert p.apply_async(power, (), {'base': 4}).get(timeout=5) == 16
+        assert p.apply(power, (5, )) == 25
+
+
+def test_map_async_single_batch_after_apply_async(executor):
+    with Pool(2) as p:
+        result = p.map_async(square, [5])
+        assert p.apply_async(square, (3, )).get() == 9
+        assert result.get() == [25]
+
+
+def slow_square(x):
+    time.sleep(0.1)
+    return x * x
+
+
+def failing_map(func, iterdata, **kwargs):
+    raise RuntimeError('invocation failed')
+
+
+def test_imap_failed_submission(executor):
+    with Pool(2) as p:
+        p._executor.map = failing_map
+        with pytest.raises(RuntimeError):
+            list(p.imap(square, range(5)))
+
+
+def test_imap_terminated(executor):
+    p = Pool(2)
+    it = p.imap(slow_square, range(10), window=1)
+    p.terminate()
+    with pytest.raises(ValueError):
+        list(it)
+
+
+def failing_generator(n):
+    for i in range(n):
+        yield i
+    raise KeyError('generator failed')
+
+
+def test_map_async_generator_raises(executor):
+    with Pool(2) as p:
+        result = p.map_async(square, failing_generator(5))
+        with pytest.raises(KeyError):
+            result.get(timeout=5)
+        assert not result.successful()
+
+
+def test_map_async_generator_failed_submission(executor):
+    with Pool(2) as p:
+        p._executor.map = failing_map
+        with pytest.raises(RuntimeError):
+            p.map_async(square, failing_generator(5)).get(timeout=5)
+
+
+def test_map_async_generator(executor):
+    with Pool(2) as p:
+        assert p.map(square, (i for i in range(7)), chunksize=3) == \
+            [i * i for i in range(7)]
+
+
+def test_speculative_map_get_timeout(executor, monkeypatch):
+    monkeypatch.setattr(pool, 'SPECULATIVE_INTERVAL', 0.01)
+    with Pool(2, speculative=True) as p:
+        result = p.map_async(slow_square, range(4), chunksize=1)
+        with pytest.raises(TimeoutError):
+            result.get(timeout=0.02)
+        assert result.get(timeout=5) == [0, 1, 4, 9]
+
+
+attempts = {}
+attempts_lock = threading.Lock()
+
+
+def _attempt(x):
+    with attempts_lock:
+        attempts[x] = attempts.get(x, 0) + 1
+        return attempts[x]
+
+
+def straggling_square(x):
+    # the first attempt of 3 is a straggler
+    if _attempt(x) == 1 and x == 3:
+        time.sleep(1)
+    return x * x
+
+
+def straggling_slow_square(x):
+    # every attempt of 3 is slow, the first one a straggler
+    if x == 3:
+        time.sleep(1 if _attempt(x) == 1 else 0.3)
+    return x * x
+
+
+def straggling_failing_square(x):
+    # the first attempt of 3 is a straggler, its copy fails
+    attempt = _attempt(x)
+    if x == 3:
+        if attempt > 1:
+            raise ValueError(x)
+        time.sleep(0.5)
+    return x * x
+
+
+@pytest.fixture
+def speculation(monkeypatch):
+    monkeypatch.setattr(pool, 'SPECULATIVE_INTERVAL', 0.01)
+    attempts.clear()
+
+
+def test_speculative_copy_wins(executor, speculation):
+    with Pool(2, speculative=True, speculative_quantile=0.5) as p:
+        result = p.map_async(straggling_square, range(4), chunksize=1)
+        start = time.monotonic()
+        assert result.get(timeout=5) == [0, 1, 4, 9]
+        assert time.monotonic() - start < 0.9
+        assert result.speculation_stats == {'launched': 1, 'used': 1}
+        # retrying a finished wait launches nothing more
+        result.wait(timeout=0.1)
+        assert result.speculation_stats == {'launched': 1, 'used': 1}
+
+
+def test_speculative_failed_copy_does_not_win(executor, speculation):
+    with Pool(2, speculative=True, speculative_quantile=0.5) as p:
+        result = p.map_async(straggling_failing_square, range(4),
+                             chunksize=1)
+        assert result.get(timeout=5) == [0, 1, 4, 9]
+        assert result.speculation_stats == {'launched': 1, 'used': 0}
+
+
+def test_speculative_retry_does_not_relaunch(executor, speculation):
+    with Pool(2, speculative=True, speculative_quantile=0.5) as p:
+        result = p.map_async(straggling_slow_square, range(4), chunksize=1)
+        while not result._copies:
+            with pytest.raises(TimeoutError):
+                result.get(timeout=0.01)
+        with pytest.raises(TimeoutError):
+            result.get(timeout=0.05)
+        assert result.get(timeout=5) == [0, 1, 4, 9]
+        assert result.speculation_stats == {'launched': 1, 'used': 1}
+
+
+def test_executor_submissions_are_serialized(executor, monkeypatch):
+    overlaps = []
+    active = threading.Semaphore(1)
+
+    class CheckingExecutor(executor):
+        def map(self, func, iterdata, **kwargs):
+            if not active.acquire(blocking=False):
+                overlaps.append(func)
+                return executor.map(self, func, iterdata, **kwargs)
+            try:
+                time.sleep(0.01)
+                return executor.map(self, func, iterdata, **kwargs)
+            finally:
+                active.release()
+
+    monkeypatch.setattr(pool, 'FunctionExecutor', CheckingExecutor)
+    with Pool(4, coalesce_window=0.005) as p:
+        it = p.imap_unordered(square, range(20), window=2)
+        results = []
+        for i in range(20):
+            results.append(p.apply_async(square, (i, )))
+            time.sleep(0.002)
+        assert sorted(it) == [i * i for i in range(20)]
+        assert [r.get() for r in results] == [i * i for i in range(20)]
+    assert not overlaps
+
+
+def test_map_async_generator_batches_like_a_list(executor):
+    with Pool(2) as p:
+        result = p.map_async(square, (i for i in range(40)))
+        assert result.get(timeout=5) == [i * i for i in range(40)]
+        assert p._executor.jobs == 1
+
+
+def test_imap_refills_half_windows(executor):
+    with Pool(4) as p:
+        assert list(p.imap(square, range(40), window=8)) == \
+            [i * i for i in range(40)]
+        assert p._executor.jobs <= 40 // 4
+
+
+def raise_value_error(x):
+    raise ValueError(x)
+
+
+def test_map_error_callback(executor):
+    errors = []
+    with Pool(2) as p:
+        result = p.map_async(raise_value_error, range(3),
+                             error_callback=errors.append)
+        with pytest.raises(ValueError):
+            result.get(timeout=5)
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+
+
+def test_map_empty_input_waits_on_nothing(executor, monkeypatch):
+    waits = []
+
+    class RecordingExecutor(executor):
+        def wait(self, fs, **kwargs):
+            waits.append(list(fs))
+            return executor.wait(self, fs, **kwargs)
+
+    monkeypatch.setattr(pool, 'FunctionExecutor', RecordingExecutor)
+    with Pool(2) as p:
+        assert p.map(square, []) == []
+        assert p.map_async(square, []).get(timeout=1) == []
+    assert [] not in waits
@@ -0,0 +1,36 @@
+import pytest
+
+from cloudbutton.multiprocessing import Process, popen_cloud
+
+
+def square(x):
+    return x * x
+
+
+class FailingExecutor:
+    def map(self, func, iterdata, **kwargs):
+        raise RuntimeError('invocation failed')
+
+
+@pytest.fixture
+def failing_executor(monkeypatch):
+    monkeypatch.setattr(popen_cloud, '_executor', FailingExecutor())
+    monkeypatch.setattr(popen_cloud, 'POLL_INTERVAL', 0.01)
+
+
+def test_failed_launch_is_reported_by_join(failing_executor):
+    processes = [Process(target=square, args=(i, )) for i in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        with pytest.raises(RuntimeError):
+            p.join()
+        assert not p.is_alive()
+        assert p.exitcode == 1
+
+
+def test_failed_launch_is_raised_by_start(failing_executor, monkeypatch):
+    monkeypatch.setattr(popen_cloud, 'LAUNCH_MAX', 1)
+    p = Process(target=square, args=(2, ))
+    with pytest.raises(RuntimeError):
+        p.start()
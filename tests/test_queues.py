@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from cloudbutton.multiprocessing import queues
+
+
+def test_feeder_sends_batches():
+    q = queues.Queue(batch_size=4, linger=0.05)
+    sent = []
+    send_bytes_many = q._send_bytes_many
+    def record(batch):
+        sent.append(len(batch))
+        send_bytes_many(batch)
+    q._send_bytes_many = record
+
+    q.put_many(range(10))
+    assert [q.get(timeout=5) for _ in range(10)] == list(range(10))
+    assert sent == [4, 4, 2]
+
+
+def test_feeder_drops_only_unpicklable_items():
+    q = queues.Queue(batch_size=10, linger=0.05)
+    errors = []
+    q._on_queue_feeder_error = lambda e, obj: errors.append(obj)
+
+    unpicklable = lambda: None
+    q.put_many([1, unpicklable, 2])
+    assert q.get(timeout=5) == 1
+    assert q.get(timeout=5) == 2
+    assert errors == [unpicklable]
+
+
+def test_put_in_cloud_worker_is_synchronous(monkeypatch):
+    monkeypatch.setenv('LITHOPS_EXECUTION_ID', 'executor/job/00000')
+    q = queues.Queue(batch_size=2)
+    q.put(0)
+    q.put_many(range(1, 5))
+    assert q._thread is None
+    assert q.qsize() == 5
+    assert q.get_many(10) == list(range(5))
+    with pytest.raises(Exception):
+        q.put(lambda: None)
+
+
+def test_bounded_put_blocks_then_times_out():
+    q = queues.Queue(2)
+    q.put_many([0, 1])
+    start = time.monotonic()
+    with pytest.raises(queues.Full):
+        q.put(2, timeout=0.3)
+    assert time.monotonic() - start >= 0.3
+    with pytest.raises(queues.Full):
+        q.put(2, timeout=1e-4)
+    assert q.qsize() == 2
+
+
+def test_bounded_put_woken_by_get():
+    q = queues.Queue(1)
+    q.put(0)
+    threading.Timer(0.2, q.get).start()
+    q.put(1, timeout=5)
+    assert q.get(timeout=1) == 1
@@ -0,0 +1,79 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from cloudbutton.multiprocessing import sharedctypes
+
+np = pytest.importorskip('numpy')
+
+
+class FakeStorage:
+    '''
+    In-memory object storage, slow enough for concurrent
+    read-modify-writes of one object to interleave
+    '''
+    objects = {}
+
+    def __init__(self):
+        self.bucket = 'bucket'
+
+    def get_object(self, bucket, key, extra_get_args=None):
+        data = self.objects[key]
+        time.sleep(0.05)
+        if extra_get_args:
+            start, end = extra_get_args['Range'][6:].split('-')
+            data = data[int(start):int(end) + 1]
+        return data
+
+    def put_object(self, bucket, key, body):
+        self.objects[key] = bytes(body)
+
+    def delete_objects(self, bucket, keys):
+        for key in keys:
+            self.objects.pop(key, None)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    module = types.ModuleType('cloudbutton.cloud_proxy')
+    module.CloudStorage = FakeStorage
+    monkeypatch.setitem(sys.modules, 'cloudbutton.cloud_proxy', module)
+    monkeypatch.setattr(FakeStorage, 'objects', {})
+
+
+def test_storage_concurrent_writes_to_one_chunk(storage):
+    # 16 rows of 64 bytes in a single chunk
+    array = sharedctypes.SharedNDArray((16, 8), 'float64', chunk_size=1024,
+                                       storage_threshold=0)
+    assert array._storage is not None
+
+    def write(start):
+        array.write(start, np.full((4, 8), start + 1.0))
+
+    writers = [threading.Thread(target=write, args=(start, ))
+               for start in (0, 8)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    data = array.read()
+    assert (data[0:4] == 1.0).all()
+    assert (data[8:12] == 9.0).all()
+    assert (data[4:8] == 0).all() and (data[12:] == 0).all()
+
+    array.unlink()
+    assert not FakeStorage.objects
+    assert not array._client.keys(array._oid + '*')
+
+
+def test_redis_roundtrip():
+    data = np.arange(60, dtype='int32').reshape(10, 6)
+    array = sharedctypes.SharedNDArray(data, chunk_size=100)
+    assert (array.read() == data).all()
+    array[2:5] = -1
+    data[2:5] = -1
+    assert (array[:] == data).all()
@@ -0,0 +1,239 @@
+import threading
+import time
+
+import pytest
+
+from cloudbutton.multiprocessing import synchronize
+
+
+@pytest.fixture(autouse=True)
+def short_wakeup_slice(monkeypatch):
+    monkeypatch.setattr(synchronize, 'WAKEUP_SLICE', 0.05)
+
+
+def test_acquire_many_timeout_unregisters():
+    sem = synchronize.Semaphore(1)
+    assert not sem.acquire_many(2, timeout=0.3)
+    assert sem._client.get(sem._name + '-waiters') is None
+    assert sem._client.llen(sem._name + '-wake') == 0
+    assert sem.get_value() == 1
+
+
+def test_acquire_many_woken_by_release():
+    sem = synchronize.Semaphore(0)
+    result = []
+    waiter = threading.Thread(
+        target=lambda: result.append(sem.acquire_many(2, timeout=5)))
+    waiter.start()
+    time.sleep(0.3)
+    assert int(sem._client.get(sem._name + '-waiters')) == 1
+    sem.release(2)
+    waiter.join()
+    assert result == [True]
+    assert sem.get_value() == 0
+    assert sem._client.get(sem._name + '-waiters') is None
+    assert sem._client.llen(sem._name + '-wake') == 0
+
+
+def test_acquire_read_timeout_unregisters():
+    lock = synchronize.RWLock()
+    assert lock.acquire_write()
+    assert not lock.acquire_read(timeout=0.3)
+    assert int(lock._client.hget(lock._handle, 'readers_waiting')) == 0
+    lock.release_write()
+    assert lock._client.llen(lock._read_wake_handle) == 0
+    assert lock.acquire_read(block=False)
+    lock.release_read()
+
+
+def test_acquire_read_woken_by_writer_release():
+    lock = synchronize.RWLock()
+    assert lock.acquire_write()
+    result = []
+    reader = threading.Thread(
+        target=lambda: result.append(lock.acquire_read(timeout=5)))
+    reader.start()
+    time.sleep(0.3)
+    assert int(lock._client.hget(lock._handle, 'readers_waiting')) == 1
+    lock.release_write()
+    reader.join()
+    assert result == [True]
+    assert int(lock._client.hget(lock._handle, 'readers_waiting')) == 0
+    assert lock._client.llen(lock._read_wake_handle) == 0
+    lock.release_read()
+
+
+def test_lease_owner_is_the_owner_id():
+    lock = synchronize.Lock(lease=10)
+    assert lock.acquire()
+    try:
+        owner, _ = lock.get_owner()
+        assert owner.rpartition(':')[0] == synchronize._owner_id()
+    finally:
+        lock.release()
+    assert lock.get_owner() is None
+
+
+def test_event_set_clear():
+    event = synchronize.Event()
+    assert not event.is_set()
+    event.set()
+    assert event.is_set()
+    assert event.wait(timeout=0.1)
+    event.clear()
+    assert not event.is_set()
+
+
+def test_event_wait_timeout_unregisters():
+    event = synchronize.Event()
+    start = time.monotonic()
+    assert not event.wait(timeout=0.2)
+    assert time.monotonic() - start >= 0.2
+    assert int(event._client.hget(event._handle, 'waiters')) == 0
+    event.set()
+    assert event._client.llen(event._wake_handle) == 0
+
+
+def test_event_wait_woken_by_set():
+    event = synchronize.Event()
+    results = []
+    waiters = [threading.Thread(
+        target=lambda: results.append(event.wait(timeout=5)))
+        for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    time.sleep(0.2)
+    event.set()
+    for waiter in waiters:
+        waiter.join()
+    assert results == [True] * 3
+    assert event._client.llen(event._wake_handle) == 0
+
+
+def _start_waiters(cond, n, results):
+    def wait():
+        with cond:
+            results.append(cond.wait(timeout=1))
+    waiters = [threading.Thread(target=wait) for _ in range(n)]
+    for waiter in waiters:
+        waiter.start()
+    while cond._client.llen(cond._notify_handle) < n:
+        time.sleep(0.01)
+    return waiters
+
+
+def _wait_keys(client):
+    return client.keys('condition-wait-*') + \
+        client.keys('ref-condition-wait-*')
+
+
+def test_condition_notify_n():
+    cond = synchronize.Condition()
+    results = []
+    waiters = _start_waiters(cond, 3, results)
+    with cond:
+        cond.notify(2)
+    for waiter in waiters:
+        waiter.join()
+    assert sorted(results) == [False, True, True]
+    assert cond._client.llen(cond._notify_handle) == 0
+    assert not _wait_keys(cond._client)
+
+
+def test_condition_notify_all():
+    cond = synchronize.Condition()
+    results = []
+    waiters = _start_waiters(cond, 3, results)
+    with cond:
+        cond.notify_all()
+    for waiter in waiters:
+        waiter.join()
+    assert results == [True] * 3
+    assert not _wait_keys(cond._client)
+
+
+def test_condition_wait_timeout():
+    cond = synchronize.Condition()
+    with cond:
+        assert not cond.wait(timeout=0.1)
+        assert cond.wait_for(lambda: False, timeout=0.1) is False
+    assert cond._client.llen(cond._notify_handle) == 0
+    assert not _wait_keys(cond._client)
+
+
+def test_condition_interrupted_wait_leaves_no_keys(monkeypatch):
+    cond = synchronize.Condition()
+    client = cond._client
+
+    def interrupted(keys, timeout=0):
+        # notified, but the waiter goes away before reading it
+        client.lrem(cond._notify_handle, 1, keys[0])
+        client.rpush(keys[0], '')
+        raise InterruptedError
+    monkeypatch.setattr(client, 'blpop', interrupted)
+
+    with cond:
+        with pytest.raises(InterruptedError):
+            cond.wait(timeout=1)
+    assert not _wait_keys(client)
+
+
+def _run_parties(n, target):
+    results = []
+    def run():
+        try:
+            results.append(target())
+        except threading.BrokenBarrierError as e:
+            results.append(e)
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_barrier_generations():
+    actions = []
+    barrier = synchronize.Barrier(3, action=lambda: actions.append(1))
+
+    def rounds():
+        return [barrier.wait(timeout=5) for _ in range(3)]
+    threads, results = _run_parties(3, rounds)
+    for thread in threads:
+        thread.join()
+
+    # every generation hands out each arrival index once
+    for generation in zip(*results):
+        assert sorted(generation) == [0, 1, 2]
+    assert len(actions) == 3
+    assert int(barrier._client.hget(barrier._handle, 'generation')) == 3
+    assert barrier.n_waiting == 0 and not barrier.broken
+
+
+def test_barrier_abort():
+    barrier = synchronize.Barrier(3)
+    threads, results = _run_parties(2, lambda: barrier.wait(timeout=5))
+    while barrier.n_waiting < 2:
+        time.sleep(0.01)
+    barrier.abort()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(r, threading.BrokenBarrierError) for r in results)
+    assert barrier.broken
+    with pytest.raises(threading.BrokenBarrierError):
+        barrier.wait()
+
+    barrier.reset()
+    assert not barrier.broken
+    threads, results = _run_parties(3, lambda: barrier.wait(timeout=5))
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [0, 1, 2]
+
+
+def test_barrier_timeout_breaks_it():
+    barrier = synchronize.Barrier(2)
+    with pytest.raises(threading.BrokenBarrierError):
+        barrier.wait(timeout=0.1)
+    assert barrier.broken
+    with pytest.raises(threading.BrokenBarrierError):
+        barrier.wait(timeout=0.1)
@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+import redis
+
+from cloudbutton.multiprocessing import util
+
+fakeredis = pytest.importorskip('fakeredis')
+FakeConnection = getattr(fakeredis, 'FakeRedisConnection',
+                         fakeredis.FakeConnection)
+
+
+@pytest.fixture
+def make_pool(redis_server):
+    def make_pool(**kwargs):
+        return util.SharedConnectionPool(
+            connection_class=FakeConnection, server=redis_server,
+            **kwargs)
+    return make_pool
+
+
+def test_full_pool_blocks_until_a_connection_is_released(make_pool):
+    pool = make_pool(max_connections=1)
+    connection = pool.get_connection()
+    threading.Timer(0.2, pool.release, args=(connection, )).start()
+    start = time.monotonic()
+    assert pool.get_connection() is connection
+    assert time.monotonic() - start >= 0.2
+    assert pool.stats() == {'created': 1, 'in_use': 1, 'available': 0,
+                            'max_connections': 1}
+
+
+def test_full_pool_times_out(make_pool):
+    pool = make_pool(max_connections=1, timeout=0.1)
+    pool.get_connection()
+    with pytest.raises(redis.ConnectionError):
+        pool.get_connection()
+    assert pool.stats()['in_use'] == 1
+
+
+def test_idle_connections_are_closed(make_pool):
+    pool = make_pool(idle_timeout=0.1)
+    client = redis.StrictRedis(connection_pool=pool)
+    client.set('x', 1)
+    connection = pool.get_connection()
+    pool.release(connection)
+    assert connection._sock is not None
+    time.sleep(0.2)
+    pool._evict_idle()
+    assert connection._sock is None
+    # reconnected on its next use
+    assert client.get('x') == b'1'
+    assert pool.stats() == {'created': 1, 'in_use': 0, 'available': 1,
+                            'max_connections': None}